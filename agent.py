@@ -1,53 +1,117 @@
 # src/agent.py
 
 import os
+import re
+import json
+import time
+import asyncio
 import numpy as np
 np.float_ = np.float64
 from dotenv import load_dotenv
-from typing import List, Any, Optional
+from functools import lru_cache
+from typing import List, Any, Iterator, Optional, Tuple
 import datetime
 from urllib.parse import urlparse
 from pydantic import BaseModel, Field
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain.tools import tool
+from langchain_core.tools import StructuredTool
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import HumanMessage
-from langchain.agents import create_agent # The main agent builder
-from langchain.agents.structured_output import ToolStrategy # Strategy for Pydantic output
-from langchain_core.messages import ToolMessage
-from langgraph.checkpoint.memory import InMemorySaver # Persistent memory
+from langchain_core.messages import ToolMessage, AIMessage, AIMessageChunk
+from src.retrieval_cache import CachedRetriever, chroma_version
+from src.lexical_index import LexicalIndex, HybridRetriever
+from src.domain_index import DomainIndex, domain_of
+from src.context_builder import ContextBuilder
+from src.embeddings import get_embedding_backend, check_collection, check_metadata
+from src.vector_store_mmap import ReopeningMmapVectorStore, mmap_version
+from src import telemetry
+from src.conversation_memory import SqliteCheckpointer, compaction_middleware, COMPACTED_PREFIX
 
 load_dotenv() 
 
 # --- CONFIGURATION ---
 PERSIST_DIRECTORY = "./data/chroma_db"
 # PERSIST_DIRECTORY = "./data/chroma_db_full"
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")  # "mmap": exact search over src/vector_store_mmap.py's index
 COLLECTION_NAME = "user-history-data"
 PROFILE_FILENAME = "data/user_profile.txt" 
-
-# Check for API Key
-if not os.getenv("OPENAI_API_KEY"):
-    raise ValueError("OPENAI_API_KEY environment variable not set. Please check your .env file.")
-
-llm = ChatOpenAI(model="gpt-4o", temperature=0)
+LINKS_LOOKUP_K = 20  # retrieval hits used to pick the domains get_links reports on
+MAX_LLM_CALLS_PER_TURN = int(os.getenv("AGENT_MAX_LLM_CALLS", 6))  # model round-trips allowed per question
+
+# --- LAZY RESOURCES ---
+# Nothing heavy is built at import time: each factory runs on first use and is cached for the
+# process (app.py additionally wraps get_agent in st.cache_resource).
+@lru_cache(maxsize=None)
+def get_llm():
+    from langchain_openai import ChatOpenAI
+
+    # Check for API Key
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY environment variable not set. Please check your .env file.")
+    return ChatOpenAI(model="gpt-4o", temperature=0)
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    # EMBEDDING_BACKEND=local embeds queries on CPU in a few ms, see src/embeddings.py
+    return get_embedding_backend()
 
 # --- VECTOR STORE ---
 # NOTE: This assumes you have already run your scraper and indexed your data.
-try:
-    embeddings = OpenAIEmbeddings() 
-    vector_store = Chroma(
-        collection_name=COLLECTION_NAME,
-        embedding_function=embeddings,
-        persist_directory=PERSIST_DIRECTORY
-    )
-    retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 8}
+@lru_cache(maxsize=None)
+def get_lexical_index() -> LexicalIndex:
+    return LexicalIndex(PERSIST_DIRECTORY)
+
+@lru_cache(maxsize=None)
+def get_vector_store():
+    if VECTOR_STORE == "mmap":
+        if mmap_version(PERSIST_DIRECTORY) is None:
+            raise ValueError(f"No memmap index in {PERSIST_DIRECTORY}. Build it with "
+                             f"`python src/vector_store_mmap.py --persist-directory {PERSIST_DIRECTORY}`.")
+        # chunk text comes from the FTS table, which holds the same chunks under the same IDs;
+        # reopened whenever the index is rebuilt, and every reopened index is checked again
+        return ReopeningMmapVectorStore(
+            PERSIST_DIRECTORY, get_lexical_index().get_documents,
+            on_open=lambda store: check_metadata(store.meta, get_embeddings(),
+                                                 f"Memmap index in {PERSIST_DIRECTORY}")
+        )
+
+    from langchain_chroma import Chroma
+
+    try:
+        vector_store = Chroma(
+            collection_name=COLLECTION_NAME,
+            embedding_function=get_embeddings(),
+            persist_directory=PERSIST_DIRECTORY
+        )
+    except Exception as e:
+        print(f"Warning: Could not initialize ChromaDB. Run data indexing steps first. Error: {e}")
+        raise
+    # a store embedded with another backend would return garbage neighbours; fail loudly instead
+    check_collection(vector_store, get_embeddings())
+    return vector_store
+
+@lru_cache(maxsize=None)
+def get_retriever() -> HybridRetriever:
+    # search_history and get_links often ask the same thing in one turn; embed + search once
+    vector_retriever = CachedRetriever(
+        get_vector_store(),
+        get_embeddings(),
+        k=8,
+        version_fn=lambda: (mmap_version if VECTOR_STORE == "mmap" else chroma_version)(PERSIST_DIRECTORY)
     )
-except Exception as e:
-    print(f"Warning: Could not initialize ChromaDB. Run data indexing steps first. Error: {e}")
+    # BM25 over the same chunks; keyword lookups ("amazon", a repo name) never need an embedding
+    return HybridRetriever(vector_retriever, get_lexical_index(), k=8)
+
+@lru_cache(maxsize=None)
+def get_domain_index() -> DomainIndex:
+    # domain -> URL aggregates maintained by ingestion, for get_links
+    return DomainIndex(PERSIST_DIRECTORY)
 
 
+@lru_cache(maxsize=None)
+def get_context_builder() -> ContextBuilder:
+    # turns search hits into the passages sent to the LLM, within CONTEXT_TOKEN_BUDGET
+    return ContextBuilder()
+
 
 # --- STRUCTURED RESPONSE ---
 class HistoryResponse(BaseModel):
@@ -63,7 +127,9 @@ def load_profile(filename: str = PROFILE_FILENAME) -> str:
     except FileNotFoundError:
         return "No user profile available."
 
-USER_PROFILE = load_profile()
+@lru_cache(maxsize=None)
+def get_user_profile() -> str:
+    return load_profile()
 
 def get_domain(url: str) -> str:
     try:
@@ -71,25 +137,44 @@ def get_domain(url: str) -> str:
     except:
         return url
 
-def format_docs(docs: List[Any]) -> tuple[str, List[str]]:
-    """Include DATES prominently in context for LLM temporal reasoning."""
+def _date_bound(value: Optional[str], end: bool = False) -> Optional[int]:
+    """'2025', '2025-11' or '2025-11-20' -> unix seconds at the start (or the end) of that period."""
+    if not value:
+        return None
+    value = value.strip()
+    for fmt, step in (("%Y-%m-%d", "day"), ("%Y-%m", "month"), ("%Y", "year")):
+        try:
+            start = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if end:
+            if step == "day":
+                start += datetime.timedelta(days=1)
+            elif step == "month":
+                start = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+            else:
+                start = start.replace(year=start.year + 1)
+        return int((start - datetime.datetime(1970, 1, 1)).total_seconds())
+    return None
+
+def parse_date_range(start_date: Optional[str], end_date: Optional[str]):
+    """Tool date arguments -> (start, end) unix seconds pushed down to the stores, or None."""
+    time_range = (_date_bound(start_date), _date_bound(end_date, end=True))
+    return time_range if any(bound is not None for bound in time_range) else None
+
+def format_docs(docs: List[Any], order: str = "relevance") -> tuple[str, List[str]]:
+    """Include DATES prominently in context for LLM temporal reasoning.
+
+    Hits go through the context builder first: overlapping chunks of a page are merged, repeated
+    boilerplate and near-duplicates dropped, and the result capped at CONTEXT_TOKEN_BUDGET.
+    """
     formatted_content = []
     unique_domains = set()
     
-    for i, doc in enumerate(docs, 1):
-        # Handle dummy data case where doc is a dict, or real data case where doc is a Document
-        if isinstance(doc, dict):
-            # Handle simulated data
-            title = doc.get('metadata', {}).get('title', f'Document {i}')
-            source_url = doc.get('metadata', {}).get('source', 'No Source')
-            date = doc.get('metadata', {}).get('date', 'No date available')
-            content = doc.get('page_content', '')
-        else:
-            # Handle real langchain Document objects
-            title = doc.metadata.get('title', f'Document {i}')
-            source_url = doc.metadata.get('source', 'No Source')
-            date = doc.metadata.get('date', 'No date available')
-            content = doc.page_content
+    for i, passage in enumerate(get_context_builder().build(docs), 1):
+        title = passage['title'] or f'Document {i}'
+        source_url = passage['source'] or 'No Source'
+        date = passage['date'] or 'No date available'
         
         domain = get_domain(source_url)
         if domain and domain != 'No Source':
@@ -99,12 +184,12 @@ def format_docs(docs: List[Any]) -> tuple[str, List[str]]:
             f"""DOCUMENT {i} (DATE: {date})
                 TITLE: {title}
                 SOURCE DOMAIN: {domain}
-                CONTENT: {content}"""
+                CONTENT: {passage['text']}"""
         )
     
     context = "\n\n---\n\n".join(formatted_content)
     return (
-        f"""RETRIEVED DOCUMENTS (sorted by relevance):
+        f"""RETRIEVED DOCUMENTS (sorted by {order}):
 {context}
 
 DOMAINS FOUND: {', '.join(unique_domains)}""",
@@ -112,72 +197,128 @@ DOMAINS FOUND: {', '.join(unique_domains)}""",
     )
 
 # --- TOOLS ---
-@tool
-def search_history(query: str) -> str:
-    """Comprehensive search of user's web browsing history INCLUDING DATES."""
-    relevant_docs = retriever.invoke(query)
-    
+# Every tool has a sync body (invoke/stream, the Streamlit app) and an async one (ainvoke, server.py);
+# both share the formatting below so the model sees exactly the same text either way.
+def _format_search_results(relevant_docs, most_recent: bool) -> str:
     if not relevant_docs:
         return "No relevant browsing history found."
-    
-    formatted_context, _ = format_docs(relevant_docs)
+    formatted_context, _ = format_docs(relevant_docs, order="date, newest first" if most_recent else "relevance")
     return formatted_context
 
-@tool
-def get_links(query: str) -> str:
-    """
-    Extract source URLs/domains from browsing history. 
-    Use ONLY when user explicitly asks for "links", "sources", "domains", "websites".
+def _search_history(query: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    most_recent: bool = False) -> str:
+    """Comprehensive search of user's web browsing history INCLUDING DATES.
+
+    Args:
+        query: what to look for.
+        start_date: optional lower bound, "YYYY", "YYYY-MM" or "YYYY-MM-DD".
+        end_date: optional upper bound (inclusive), same formats.
+        most_recent: True for "latest"/"most recent"/"last time" questions; returns newest matches first.
     """
-    relevant_docs = retriever.invoke(query)
-    
+    time_range = parse_date_range(start_date, end_date)
+    if most_recent:
+        relevant_docs = get_retriever().invoke_recent(query, time_range=time_range)
+    else:
+        relevant_docs = get_retriever().invoke(query, time_range=time_range)
+    return _format_search_results(relevant_docs, most_recent)
+
+async def _asearch_history(query: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                           most_recent: bool = False) -> str:
+    time_range = parse_date_range(start_date, end_date)
+    if most_recent:
+        relevant_docs = await get_retriever().ainvoke_recent(query, time_range=time_range)
+    else:
+        relevant_docs = await get_retriever().ainvoke(query, time_range=time_range)
+    return _format_search_results(relevant_docs, most_recent)
+
+search_history = StructuredTool.from_function(func=_search_history, coroutine=_asearch_history,
+                                              name="search_history")
+
+def _month_year(ts: Optional[int]) -> str:
+    if not ts:
+        return "unknown"
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=ts)).strftime("%B %Y")
+
+def _links_report(relevant_docs, time_range) -> str:
+    """Domains of the retrieval hits, with totals and top URLs from the aggregate table."""
     if not relevant_docs:
         return "No source links found for this query."
     
-    links_info = []
-    seen_domains = set()
-    
+    hit_urls, domains = [], []
     for doc in relevant_docs:
         # Handle dict or Document type for metadata access
         metadata = doc.metadata if not isinstance(doc, dict) else doc.get('metadata', {})
-        
-        source_url = metadata.get('source', 'No Source')
-        domain = get_domain(source_url)
-        
-        if source_url != 'No Source' and domain not in seen_domains:
-            links_info.append({
-                'url': source_url,
-                'domain': domain,
-                'title': metadata.get('title', 'No Title'),
-                'date': metadata.get('date', 'No date')
-            })
-            seen_domains.add(domain)
+        source_url = metadata.get('source')
+        if not source_url:
+            continue
+        hit_urls.append(source_url)
+        domain = domain_of(source_url)
+        if domain and domain not in domains:
+            domains.append(domain)
     
-    if not links_info:
-        return "No unique source links found."
+    # ...then the counts come from the aggregate table over the whole history
+    domain_index = get_domain_index()
+    summaries = domain_index.domain_summaries(domains, time_range=time_range)
+    if not summaries:
+        # store indexed before the domain table existed (see src/upgrade_store.py): list the hits
+        links = {}
+        for doc in relevant_docs:
+            metadata = doc.metadata if not isinstance(doc, dict) else doc.get('metadata', {})
+            domain = domain_of(metadata.get('source', ''))
+            if domain and domain not in links:
+                links[domain] = f"• {metadata.get('title', 'No Title')} ({metadata.get('date', 'No date')}): {metadata['source']} [{domain}]"
+        if not links:
+            return "No unique source links found."
+        return f"FOUND {len(links)} UNIQUE SOURCE LINKS:\n" + "\n".join(links.values())
     
-    links_text = "\n".join([
-        f"• {item['title']} ({item['date']}): {item['url']} [{item['domain']}]"
-        for item in links_info
-    ])
+    lines = []
+    for summary in summaries:
+        lines.append(
+            f"• {summary['domain']}: {summary['pages']} pages, {summary['visits']} visits "
+            f"(first {_month_year(summary['first_visit_ts'])}, last {_month_year(summary['last_visit_ts'])})"
+        )
+        for link in domain_index.top_urls(summary['domain'], limit=3, prefer=hit_urls, time_range=time_range):
+            lines.append(f"    - {link['title'] or 'No Title'} ({_month_year(link['last_visit_ts'])}): {link['url']}")
     
-    return f"FOUND {len(links_info)} UNIQUE SOURCE LINKS:\n{links_text}"
+    return f"FOUND {len(summaries)} UNIQUE SOURCE DOMAINS:\n" + "\n".join(lines)
+
+def _get_links(query: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
+    """
+    Extract source URLs/domains from browsing history. 
+    Use ONLY when user explicitly asks for "links", "sources", "domains", "websites".
+    start_date / end_date optionally limit the period ("YYYY", "YYYY-MM" or "YYYY-MM-DD").
+    """
+    time_range = parse_date_range(start_date, end_date)
+    # cheap semantic lookup only to find WHICH sites are relevant...
+    relevant_docs = get_retriever().invoke(query, k=LINKS_LOOKUP_K, time_range=time_range)
+    return _links_report(relevant_docs, time_range)
+
+async def _aget_links(query: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
+    time_range = parse_date_range(start_date, end_date)
+    relevant_docs = await get_retriever().ainvoke(query, k=LINKS_LOOKUP_K, time_range=time_range)
+    # the domain table is local SQLite; keep it off the event loop
+    return await asyncio.to_thread(_links_report, relevant_docs, time_range)
+
+get_links = StructuredTool.from_function(func=_get_links, coroutine=_aget_links, name="get_links")
 
 TOOLS = [search_history, get_links]
 
 # --- SYSTEM PROMPT ---
-LLM_PROMPT = f"""
+def build_system_prompt(user_profile: str) -> str:
+    return f"""
 You analyze Valentina's web browsing history, and provide users with answer about it.
-Basic context about Valentina: {USER_PROFILE}
+Basic context about Valentina: {user_profile}
 
 RULES:
 1. ALWAYS call 'search_history' FIRST
 2. Examine document dates ONLY for temporal questions ("latest", "when", "recent"), BUT do not specify the exact date (only month and year). 
+   For "latest"/"most recent" questions call 'search_history' with most_recent=true; for a period ("in March", "last summer") pass start_date/end_date.
 3. Answer using HistoryResponse schema
 4. ONLY call 'get_links' if user wants to find out more about the source of the web search.
 5. DO NOT hallucinate at all, especially if you cannot find context.
 6. DO NOT provide any personal information, be as general as possible, for instance, avoid being as specific about job search, companies or names of people.
 7. SUMMARIZE briefly what you find, be as general as possible to protect privacy.
+8. When you need several searches (or a search and 'get_links'), request them together in one message; they run in parallel.
 
 EXAMPLE TEMPORAL REASONING:
 DOC 1 (DATE: 2024-05-15): Niacinamide Serum
@@ -185,47 +326,217 @@ DOC 2 (DATE: 2024-11-20): Air purifier filter
 Q: "Latest amazon search?" → Answer: "The most recent amazon search was in November for air purifier filters."""
 
 # --- AGENT CREATION & INVOKE ---
-checkpointer = InMemorySaver()
-agent = create_agent(
-    model=llm,
-    tools=TOOLS, 
-    system_prompt=LLM_PROMPT,
-    response_format=ToolStrategy(HistoryResponse),
-    checkpointer=checkpointer
-)
+@lru_cache(maxsize=None)
+def get_checkpointer() -> SqliteCheckpointer:
+    # conversations survive restarts; idle threads expire (CONVERSATION_TTL_DAYS, MAX_CONVERSATIONS)
+    return SqliteCheckpointer()
+
+@lru_cache(maxsize=None)
+def get_agent():
+    from langchain.agents import create_agent # The main agent builder
+    from langchain.agents.structured_output import ToolStrategy # Strategy for Pydantic output
+    from langchain.agents.middleware import ModelCallLimitMiddleware
+
+    return create_agent(
+        model=get_llm(),
+        tools=TOOLS, 
+        system_prompt=build_system_prompt(get_user_profile()),
+        response_format=ToolStrategy(HistoryResponse),
+        # past tool results are compacted and old turns dropped before every model call;
+        # a question that keeps asking for tools ends after MAX_LLM_CALLS_PER_TURN model calls
+        middleware=[compaction_middleware(),
+                    ModelCallLimitMiddleware(run_limit=MAX_LLM_CALLS_PER_TURN, exit_behavior="end")],
+        checkpointer=get_checkpointer()
+    )
+
+def get_retrieval_stats() -> dict:
+    """Hit rates of the retrieval cache and lexical fast path, plus context tokens saved, for the UI / logs."""
+    return {**get_retriever().stats(), "context": get_context_builder().stats()}
+
+class TurnTelemetry(BaseCallbackHandler):
+    """Callback handler for one turn: times every LLM round-trip and tool call, counts tokens."""
+
+    def __init__(self):
+        self.started = {}
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.retrievals = 0  # search_history calls
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def config(self, thread_id: str) -> dict:
+        return {"configurable": {"thread_id": thread_id}, "callbacks": [self]}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.llm_calls += 1
+        if run_id in self.started:
+            telemetry.record_duration("agent.llm_call", time.perf_counter() - self.started.pop(run_id))
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.tokens_in += usage.get("input_tokens", 0)
+                self.tokens_out += usage.get("output_tokens", 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.started.pop(run_id, None)
+        telemetry.count("agent.llm_errors")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self.started[run_id] = (time.perf_counter(), (serialized or {}).get("name", "tool"))
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        started = self.started.pop(run_id, None)
+        if isinstance(started, tuple):
+            self.tool_calls += 1
+            self.retrievals += started[1] == "search_history"
+            telemetry.record_duration(f"agent.tool.{started[1]}", time.perf_counter() - started[0])
+
+    def finish(self):
+        telemetry.count("agent.turns")
+        telemetry.count("llm.tokens_in", self.tokens_in)
+        telemetry.count("llm.tokens_out", self.tokens_out)
+        telemetry.observe("agent.llm_calls_per_turn", self.llm_calls)
+        telemetry.observe("agent.tool_calls_per_turn", self.tool_calls)
+        telemetry.observe("agent.retrievals_per_turn", self.retrievals)
+        telemetry.observe("agent.tokens_in_per_turn", self.tokens_in)
+
+def _fallback_response(last_text: str, turn: TurnTelemetry) -> HistoryResponse:
+    """For turns that ended without a HistoryResponse."""
+    if turn.llm_calls >= MAX_LLM_CALLS_PER_TURN:
+        telemetry.count("agent.llm_call_limit_hit")
+        return HistoryResponse(answer="I couldn't finish looking this up within the allowed number of "
+                                      "steps. Try a more specific question.")
+    # the model answered in plain text instead of the schema
+    return HistoryResponse(answer=last_text or "I couldn't produce an answer.")
+
+def _turn_response(result: dict, turn: TurnTelemetry) -> HistoryResponse:
+    # structured_response is checkpointed with the thread, so it can be an earlier turn's answer:
+    # only take it when this turn's messages (everything after its question) include the answer call
+    messages = result.get("messages") or []
+    start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1) + 1
+    this_turn = messages[start:]
+    answered = any(call["name"] == HistoryResponse.__name__
+                   for m in this_turn if isinstance(m, AIMessage) for call in m.tool_calls)
+    if answered and result.get("structured_response") is not None:
+        return result["structured_response"]
+    content = getattr(this_turn[-1], "content", "") if this_turn else ""
+    return _fallback_response(content if isinstance(content, str) else "", turn)
 
 def history_qa_agent_invoke(question: str, thread_id: str) -> HistoryResponse:
-    state = {"messages": [HumanMessage(content=question)]}
-
-    while True:
-        result = agent.invoke(state, config={"configurable": {"thread_id": thread_id}})
-        msg = result["messages"][-1]
-
-        # 1. If LLM wants to call a tool
-        if hasattr(msg, "tool_calls") and msg.tool_calls:
-            tool_call = msg.tool_calls[0]
-            tool_name = tool_call["name"]
-            tool_args = tool_call["args"]
-            tool_id = tool_call["id"]
-
-            # 2. Execute the tool
-            if tool_name == "search_history":
-                tool_result = search_history.invoke(tool_args)
-            elif tool_name == "get_links":
-                tool_result = get_links.invoke(tool_args)
+    """One graph run per question: the graph's tool node executes every tool call the model makes
+    (several at once in parallel) and the model call limit bounds the round-trips."""
+    turn = TurnTelemetry()
+    with telemetry.span("agent.turn"):
+        result = get_agent().invoke({"messages": [HumanMessage(content=question)]},
+                                    config=turn.config(thread_id))
+    turn.finish()
+    return _turn_response(result, turn)
+
+
+async def history_qa_agent_ainvoke(question: str, thread_id: str) -> HistoryResponse:
+    """Async counterpart of history_qa_agent_invoke: model calls, embeddings and vector search are
+    awaited, so one event loop can serve many sessions (see server.py)."""
+    turn = TurnTelemetry()
+    with telemetry.span("agent.turn"):
+        result = await get_agent().ainvoke({"messages": [HumanMessage(content=question)]},
+                                           config=turn.config(thread_id))
+    turn.finish()
+    return _turn_response(result, turn)
+
+
+# --- STREAMING ---
+class _AnswerStreamer:
+    """Pulls the growing "answer" string out of the HistoryResponse tool-call JSON as it streams."""
+
+    ANSWER_START = re.compile(r'"answer"\s*:\s*"')
+
+    def __init__(self):
+        self.buffer = ""
+        self.emitted = 0
+
+    def feed(self, fragment: str) -> str:
+        self.buffer += fragment
+        match = self.ANSWER_START.search(self.buffer)
+        if not match:
+            return ""
+
+        raw, chars, i = self.buffer[match.end():], [], 0
+        while i < len(raw) and raw[i] != '"':
+            if raw[i] == "\\":
+                # only decode complete escapes, the rest arrives with the next fragment
+                length = 6 if raw[i + 1:i + 2] == "u" else 2
+                if length == 6 and "d800" <= raw[i + 2:i + 6].lower() <= "dbff":
+                    length = 12  # high surrogate: decode it together with the low one after it
+                if i + length > len(raw):
+                    break
+                chars.append(json.loads(f'"{raw[i:i + length]}"'))
+                i += length
             else:
-                tool_result = "Unknown tool"
-
-            state["messages"].append(
-                ToolMessage(
-                    content=tool_result,
-                    tool_call_id=tool_id,
-                )
-            )
+                chars.append(raw[i])
+                i += 1
+
+        text = "".join(chars)
+        delta = text[self.emitted:]
+        self.emitted = len(text)
+        return delta
+
+def history_qa_agent_stream(question: str, thread_id: str) -> Iterator[Tuple[str, Any]]:
+    """Streaming counterpart of history_qa_agent_invoke.
+
+    Yields (event, payload) pairs as the graph runs:
+      ("tool", {"name", "args"})  - the model asked for a tool
+      ("tool_done", {"name"})     - the tool returned
+      ("token", str)              - next piece of the answer text
+      ("final", HistoryResponse)  - the complete structured response, always last
+    """
+    turn = TurnTelemetry()
+    config = turn.config(thread_id)
+    turn_started = time.perf_counter()
+    answer_name = HistoryResponse.__name__
+    streamer = _AnswerStreamer()
+    tool_names = {}  # tool-call chunk index -> name (only the first chunk carries it)
+    final, last_text = None, ""
+
+    for mode, chunk in get_agent().stream({"messages": [HumanMessage(content=question)]},
+                                    config=config, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            message, _ = chunk
+            if not isinstance(message, AIMessageChunk):
+                continue
+            for call in message.tool_call_chunks:
+                if call.get("name"):
+                    tool_names[call.get("index")] = call["name"]
+                if tool_names.get(call.get("index")) == answer_name and call.get("args"):
+                    delta = streamer.feed(call["args"])
+                    if delta:
+                        yield "token", delta
             continue
 
-        # 4. Final output
-        return result["structured_response"]
+        # mode == "updates": one dict per finished node
+        for update in chunk.values():
+            if not isinstance(update, dict):
+                continue
+            for message in update.get("messages", []):
+                if isinstance(message, AIMessage):
+                    tool_names = {}  # next model call starts a new set of chunk indexes
+                    if isinstance(message.content, str) and message.content:
+                        last_text = message.content
+                    for call in message.tool_calls:
+                        if call["name"] != answer_name:
+                            yield "tool", {"name": call["name"], "args": call["args"]}
+                elif isinstance(message, ToolMessage) and message.name != answer_name:
+                    if isinstance(message.content, str) and message.content.startswith(COMPACTED_PREFIX):
+                        continue  # an earlier turn's result rewritten by compaction_middleware
+                    yield "tool_done", {"name": message.name}
+            if update.get("structured_response") is not None:
+                final = update["structured_response"]
+
+    telemetry.record_duration("agent.turn", time.perf_counter() - turn_started)
+    turn.finish()
+    yield "final", final if final is not None else _fallback_response(last_text, turn)
 
 
 if __name__ == "__main__":
@@ -250,3 +561,4 @@ if __name__ == "__main__":
     r3 = history_qa_agent_invoke(q3, TEST_THREAD_ID)
     
     print(f"\nAI Answer (Uses search_history context):\n{r3.answer[:150]}...")
+    print(f"\nRetrieval cache: {get_retrieval_stats()}")
@@ -1,19 +1,26 @@
+import uuid
 import streamlit as st
 import numpy as np
 np.float_ = np.float64
 
-from agent import history_qa_agent_invoke, HistoryResponse, load_profile
+from agent import history_qa_agent_stream, HistoryResponse, get_agent, get_user_profile
 
-# --- CONFIGURATION ---
-TEST_THREAD_ID = "streamlit_session"
+# Streamlit re-runs this script on every interaction; the agent (LLM client, Chroma store,
+# compiled graph) and the profile are built once per process and shared by every rerun/session
+@st.cache_resource(show_spinner="Loading memory...")
+def load_agent():
+    return get_agent()
 
-# Load user profile once
-USER_PROFILE = load_profile()
+@st.cache_resource(show_spinner=False)
+def load_user_profile():
+    return get_user_profile()
 
 # --- STREAMLIT SETUP ---
 st.set_page_config(page_title="Personal Web Memory Agent", layout="wide")
 st.title("Valentina's Web Memory Agent")
 
+USER_PROFILE = load_user_profile()
+
 st.markdown("""
     Welcome! This agent uses AI to search my personal browsing history and allows you to have conversations with it.
 """)
@@ -21,9 +28,14 @@ st.markdown("""
 with st.expander("🔒 User Profile"):
     st.markdown(USER_PROFILE)
 
+load_agent()
+
 # Initialize chat history in Streamlit session state
 if "messages" not in st.session_state:
     st.session_state.messages = []
+# every browser session gets its own agent conversation thread
+if "thread_id" not in st.session_state:
+    st.session_state.thread_id = f"streamlit-{uuid.uuid4().hex}"
 
 # Display chat messages from history
 for message in st.session_state.messages:
@@ -36,16 +48,32 @@ if prompt := st.chat_input("Ask something..."):
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    with st.spinner("Searching memory..."):
+    with st.chat_message("assistant"):
+        # tool progress and answer tokens are rendered as they arrive
+        status = st.status("Searching memory...", expanded=False)
+        placeholder = st.empty()
+        streamed_answer = ""
         try:
-            response: HistoryResponse = history_qa_agent_invoke(prompt, thread_id=TEST_THREAD_ID)
+            response: HistoryResponse = None
+            for event, payload in history_qa_agent_stream(prompt, thread_id=st.session_state.thread_id):
+                if event == "tool":
+                    args = ", ".join(f"{k}={v!r}" for k, v in payload["args"].items())
+                    status.write(f"🔎 {payload['name']}({args})")
+                elif event == "tool_done":
+                    status.update(label="Reading what I found...")
+                elif event == "token":
+                    streamed_answer += payload
+                    placeholder.markdown(streamed_answer + "▌")
+                elif event == "final":
+                    response = payload
             agent_response = response.answer
+            status.update(label="Done", state="complete")
         except Exception as e:
             agent_response = f"An internal error occurred: {e}"
+            status.update(label="Failed", state="error")
             st.error("Agent failed to process the request. See console for full error.")
             print(f"--- AGENT FAILURE --- \n Full Error: {e}")
 
-    with st.chat_message("assistant"):
-        st.markdown(agent_response)
+        placeholder.markdown(agent_response)
 
-    st.session_state.messages.append({"role": "assistant", "content": agent_response})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": agent_response})
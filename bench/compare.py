@@ -0,0 +1,54 @@
+# Compare two bench.run result files and flag regressions
+#
+#   python -m bench.compare bench_results/baseline.json bench_results/new.json --threshold 0.10
+
+import sys
+import json
+import argparse
+
+DEFAULT_THRESHOLD = 0.10  # 10% slower (throughput or p95) counts as a regression
+
+
+def _change(base, new):
+    return (new - base) / base if base else 0.0
+
+def compare(base: dict, new: dict, threshold: float = DEFAULT_THRESHOLD):
+    """Print a per-stage table; returns the stages that got slower by more than `threshold`."""
+    base_stages = {s["stage"]: s for s in base["stages"]}
+    regressions = []
+    print(f"base: {base['meta'].get('revision')} ({base['meta'].get('timestamp')})  "
+          f"new: {new['meta'].get('revision')} ({new['meta'].get('timestamp')})")
+    print(f"{'stage':<28} {'throughput':>22} {'p50 ms':>20} {'p95 ms':>20}")
+    for stage in new["stages"]:
+        old = base_stages.get(stage["stage"])
+        if old is None:
+            print(f"{stage['stage']:<28} (new stage)")
+            continue
+        throughput = _change(old["throughput"], stage["throughput"])
+        p50 = _change(old["p50_ms"], stage["p50_ms"])
+        p95 = _change(old["p95_ms"], stage["p95_ms"])
+        slower = throughput < -threshold or p95 > threshold
+        if slower:
+            regressions.append(stage["stage"])
+        print(f"{stage['stage']:<28} {stage['throughput']:>12.1f} ({throughput:+7.1%}) "
+              f"{stage['p50_ms']:>10.2f} ({p50:+7.1%}) {stage['p95_ms']:>10.2f} ({p95:+7.1%})"
+              f"{'  ⚠️ REGRESSION' if slower else ''}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs.")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,53 @@
+# Offline stand-ins for OpenAI: deterministic embeddings and a chat model that drives the agent
+# through one search_history call and a HistoryResponse, like a typical turn
+
+import time
+import uuid
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+EMBEDDING_SIZE = 1536  # same width as text-embedding-ada-002 / -3-small
+
+
+def fake_embeddings(size: int = EMBEDDING_SIZE) -> DeterministicFakeEmbedding:
+    # the same text always maps to the same vector, so caches and upserts behave like the real thing
+    return DeterministicFakeEmbedding(size=size)
+
+
+class FakeHistoryChatModel(BaseChatModel):
+    """First call of a turn asks for search_history with the question, the next one answers.
+
+    `latency_ms` simulates the model round-trip so agent timings include a realistic wait.
+    """
+
+    latency_ms: float = 0.0
+    answer_tool: str = "HistoryResponse"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-history-chat"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _next_message(self, messages: List[Any]) -> AIMessage:
+        self.calls += 1
+        turn_start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        tool_results = [m for m in messages[turn_start:] if isinstance(m, ToolMessage)]
+        if not tool_results:
+            call = {"name": "search_history", "args": {"query": str(messages[turn_start].content)}}
+        else:
+            call = {"name": self.answer_tool,
+                    "args": {"answer": f"Found {len(str(tool_results[-1].content))} characters of context."}}
+        call["id"] = f"call_{uuid.uuid4().hex[:12]}"
+        return AIMessage(content="", tool_calls=[call])
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
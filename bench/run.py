@@ -0,0 +1,208 @@
+# Offline benchmark of the whole pipeline: synthetic History file -> fetch -> transform/split ->
+# index -> retrieval -> format_docs -> agent turn. Nothing leaves the machine.
+#
+#   python -m bench.run --urls 5000 --pages 500 --out bench_results/baseline.json
+#   python -m bench.compare bench_results/baseline.json bench_results/new.json
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# only the repo root: ingestion modules are imported as src.*, the same modules agent.py uses, so the
+# process has one telemetry registry (with src/ on the path too they would load a second time)
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+from bench.synthetic import PageServer, make_history_db, WORDS
+from bench.fakes import FakeHistoryChatModel, fake_embeddings
+
+
+# --- MEASUREMENT ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize(stage, latencies, items, seconds, unit):
+    latencies = sorted(latencies)
+    result = {
+        "stage": stage,
+        "items": items,
+        "seconds": round(seconds, 4),
+        "throughput": round(items / seconds, 2) if seconds else 0.0,
+        "unit": unit,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+    }
+    print(f"{stage:<28} {result['throughput']:>10.1f} {unit:<9} "
+          f"p50 {result['p50_ms']:>9.2f} ms  p95 {result['p95_ms']:>9.2f} ms  ({items} in {seconds:.2f}s)")
+    return result
+
+def timed_iter(iterable, latencies):
+    """Yield from `iterable`, recording the wait for each item (steady-state cost per item)."""
+    last = time.perf_counter()
+    for item in iterable:
+        now = time.perf_counter()
+        latencies.append(now - last)
+        last = now
+        yield item
+
+def timed_calls(fn, args_list):
+    latencies, results = [], []
+    for args in args_list:
+        started = time.perf_counter()
+        results.append(fn(*args))
+        latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+def make_queries(count, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))) for _ in range(count)]
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# --- BENCHMARK ---
+def run(args):
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="history-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    store_dir = workdir / "chroma_db"
+    shutil.rmtree(store_dir, ignore_errors=True)
+    # read when src.conversation_memory is imported, so it has to be set before `import agent`
+    os.environ["CONVERSATION_DB_PATH"] = str(workdir / "conversations.sqlite3")
+
+    from src import extract_urls
+    from src.fetcher import iter_fetch_documents
+    from src.transform import iter_transform_pages
+    from src.ingest_state import IngestState
+    from src.lexical_index import LexicalIndex
+    from src.domain_index import DomainIndex
+    from src.scraping import BatchCommitter, COLLECTION_NAME
+    from langchain_chroma import Chroma
+
+    results = []
+    embeddings = fake_embeddings()
+
+    with PageServer(port=args.port, latency_ms=args.page_latency_ms) as server:
+        history_db = workdir / "History"
+        make_history_db(history_db, args.urls, sites=args.sites, base_url=server.base_url, seed=args.seed)
+        extract_urls.HISTORY_FILES = [history_db]
+
+        # 1. HISTORY EXTRACTION
+        latencies, outputs = timed_calls(extract_urls.get_history_data,
+                                         [("2025-01-01", "2025-12-01")] * args.repeat)
+        records = outputs[-1]
+        results.append(summarize("get_history_data", latencies, len(records) * args.repeat,
+                                 sum(latencies), "rows/s"))
+
+        # 2. FETCH (one local host, so the per-host limit is lifted to the global one)
+        sample = records[:args.pages]
+        latencies, started = [], time.perf_counter()
+        fetched = list(timed_iter(iter_fetch_documents(sample, max_concurrency=args.concurrency,
+                                                       per_host_limit=args.concurrency), latencies))
+        results.append(summarize("fetch", latencies, len(fetched), time.perf_counter() - started, "pages/s"))
+
+    # 3. TRANSFORM / SPLIT
+    latencies, started = [], time.perf_counter()
+    transformed = list(timed_iter(iter_transform_pages(fetched, workers=args.workers), latencies))
+    results.append(summarize("transform_split", latencies, len(transformed),
+                             time.perf_counter() - started, "pages/s"))
+
+    # 4. INDEX (fake embeddings, real Chroma + FTS + domain table)
+    vector_store = Chroma(collection_name=COLLECTION_NAME, embedding_function=embeddings,
+                          persist_directory=str(store_dir))
+    state = IngestState(str(store_dir))
+    domain_index = DomainIndex(str(store_dir))
+    for record in records:
+        domain_index.add_visit(record)
+    domain_index.flush()
+    committer = BatchCommitter(vector_store, state, commit_every=args.commit_every,
+                               lexical_index=LexicalIndex(str(store_dir)))
+    latencies, started = [], time.perf_counter()
+    for record, page_hash, splits, _ in transformed:
+        page_started = time.perf_counter()
+        committer.add_page(record['url'], page_hash, splits, record.get('last_visit_time'))
+        latencies.append(time.perf_counter() - page_started)
+    committer.commit()
+    state.close()
+    results.append(summarize("index", latencies, committer.total_chunks, time.perf_counter() - started,
+                             "chunks/s"))
+
+    # 5. RETRIEVAL + CONTEXT + AGENT, through agent.py with the OpenAI clients swapped for fakes
+    import agent
+    agent.PERSIST_DIRECTORY = str(store_dir)
+    fake_llm = FakeHistoryChatModel(latency_ms=args.llm_latency_ms)
+    agent.get_llm = lambda: fake_llm
+    agent.get_embeddings = lambda: embeddings
+
+    queries = make_queries(args.queries, seed=args.seed)
+    retriever = agent.get_retriever()
+    for stage in ("retriever.invoke (cold)", "retriever.invoke (warm)"):
+        latencies, hits = timed_calls(retriever.invoke, [(q,) for q in queries])
+        results.append(summarize(stage, latencies, len(queries), sum(latencies), "queries/s"))
+
+    latencies, _ = timed_calls(agent.format_docs, [(docs,) for docs in hits])
+    results.append(summarize("format_docs", latencies, len(hits), sum(latencies), "calls/s"))
+
+    turns = queries[:args.turns]
+    latencies, _ = timed_calls(agent.history_qa_agent_invoke,
+                               [(q, f"bench-{i}") for i, q in enumerate(turns)])
+    results.append(summarize("history_qa_agent_invoke", latencies, len(turns), sum(latencies), "turns/s"))
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "llm_calls": fake_llm.calls,
+            "retrieval": agent.get_retrieval_stats(),
+        },
+        "stages": results,
+    }
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+        print(f"Results written to {args.out}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingestion / retrieval / agent benchmarks.")
+    parser.add_argument("--urls", type=int, default=5000, help="rows in the synthetic History file")
+    parser.add_argument("--sites", type=int, default=50, help="distinct sites the URLs belong to")
+    parser.add_argument("--pages", type=int, default=500, help="pages fetched, split and indexed")
+    parser.add_argument("--queries", type=int, default=50, help="retrieval / format_docs calls")
+    parser.add_argument("--turns", type=int, default=10, help="full agent turns")
+    parser.add_argument("--repeat", type=int, default=3, help="get_history_data repetitions")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2, help="transform processes (1 = no pool)")
+    parser.add_argument("--commit-every", type=int, default=1000)
+    parser.add_argument("--page-latency-ms", type=float, default=20.0, help="simulated server latency")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated model round-trip")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="keep the generated files here instead of a temp dir")
+    parser.add_argument("--out", help="write the results as JSON (input for bench.compare)")
+    run(parser.parse_args())
@@ -0,0 +1,126 @@
+# Synthetic inputs for the benchmarks: a Chrome-shaped History database and a local HTTP server
+# that serves a deterministic HTML page for every URL in it
+
+import random
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+CHROME_EPOCH = datetime(1601, 1, 1)
+WORDS = ("retrieval augmented generation vector index embedding python async sqlite browser history "
+         "chunk token latency cache serum filter purifier recipe travel flight hotel review guide "
+         "tutorial release notes benchmark throughput memory disk network query answer agent model "
+         "career job interview resume salary apartment rent budget finance market news weather").split()
+BOILERPLATE_NAV = ["Home", "Products", "Blog", "About us", "Sign in", "Contact"]
+BOILERPLATE_FOOTER = "© 2025 Example Corp. All rights reserved. Privacy policy · Terms of use · Cookie settings"
+
+
+def _chrome_time(dt: datetime) -> int:
+    return int((dt - CHROME_EPOCH).total_seconds() * 1000000)
+
+
+def page_url(base_url: str, site: int, page: int) -> str:
+    return f"{base_url}/site{site}/page{page}"
+
+
+def make_history_db(path, urls: int, sites: int = 50, base_url: str = "http://127.0.0.1:8765",
+                    start: str = "2025-01-01", end: str = "2025-12-01", seed: int = 0):
+    """Write a History file with Chrome's `urls` and `visits` tables and `urls` rows spread over
+    [start, end). Returns the number of URL rows."""
+    rng = random.Random(seed)
+    start_dt, end_dt = datetime.fromisoformat(start), datetime.fromisoformat(end)
+    span = (end_dt - start_dt).total_seconds()
+
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        DROP TABLE IF EXISTS urls;
+        DROP TABLE IF EXISTS visits;
+        CREATE TABLE urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url LONGVARCHAR, title LONGVARCHAR,
+                           visit_count INTEGER DEFAULT 0 NOT NULL, typed_count INTEGER DEFAULT 0 NOT NULL,
+                           last_visit_time INTEGER NOT NULL, hidden INTEGER DEFAULT 0 NOT NULL);
+        CREATE INDEX urls_url_index ON urls (url);
+        CREATE TABLE visits (id INTEGER PRIMARY KEY, url INTEGER NOT NULL, visit_time INTEGER NOT NULL,
+                             from_visit INTEGER, transition INTEGER DEFAULT 0 NOT NULL,
+                             visit_duration INTEGER DEFAULT 0 NOT NULL);
+        CREATE INDEX visits_url_index ON visits (url);
+        CREATE INDEX visits_time_index ON visits (visit_time);
+    """)
+    url_rows, visit_rows = [], []
+    for i in range(urls):
+        site = rng.randrange(sites)
+        visit_count = 1 + int(rng.paretovariate(1.5))
+        times = sorted(start_dt + timedelta(seconds=rng.random() * span) for _ in range(min(visit_count, 20)))
+        title = " ".join(rng.choice(WORDS) for _ in range(5)).title()
+        url_rows.append((i + 1, page_url(base_url, site, i), title, visit_count, _chrome_time(times[-1])))
+        visit_rows.extend((i + 1, _chrome_time(t)) for t in times)
+    conn.executemany("INSERT INTO urls (id, url, title, visit_count, last_visit_time) VALUES (?, ?, ?, ?, ?)",
+                     url_rows)
+    conn.executemany("INSERT INTO visits (url, visit_time) VALUES (?, ?)", visit_rows)
+    conn.commit()
+    conn.close()
+    return len(url_rows)
+
+
+def make_page(site: int, page: int, paragraphs: int = 12) -> str:
+    """Deterministic HTML for one URL: shared nav/footer per site plus page-specific paragraphs."""
+    rng = random.Random(site * 1_000_003 + page)
+    body = "\n".join(
+        "<p>" + " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 90))) + ".</p>"
+        for _ in range(paragraphs)
+    )
+    nav = "".join(f'<li><a href="/site{site}/{item.lower()}">{item}</a></li>' for item in BOILERPLATE_NAV)
+    title = " ".join(rng.choice(WORDS) for _ in range(5)).title()
+    return (f"<html><head><title>{title}</title></head><body><nav><ul>{nav}</ul></nav>"
+            f"<h1>{title}</h1>\n{body}\n<footer>{BOILERPLATE_FOOTER}</footer></body></html>")
+
+
+class PageServer:
+    """aiohttp stand-in for the web, on its own thread so the fetcher's event loop is untouched."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, latency_ms: float = 0.0,
+                 paragraphs: int = 12):
+        self.host, self.port = host, port
+        self.latency_ms = latency_ms
+        self.paragraphs = paragraphs
+        self.requests = 0
+        self._loop = None
+        self._runner = None
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _page(self, request):
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        site = int(request.match_info["site"])
+        page = int(request.match_info["page"])
+        return web.Response(text=make_page(site, page, self.paragraphs), content_type="text/html")
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        app = web.Application()
+        app.add_routes([web.get(r"/site{site:\d+}/page{page:\d+}", self._page)])
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        self._loop.run_until_complete(web.TCPSite(self._runner, self.host, self.port).start())
+        self._ready.set()
+        self._loop.run_forever()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._serve, name="bench-pages", daemon=True)
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
@@ -0,0 +1,156 @@
+# server.py
+# Local HTTP service around the async agent: one conversation thread per client session,
+# a cap on concurrent agent turns (i.e. concurrent LLM calls) and a bounded wait queue.
+
+import os
+import time
+import uuid
+import asyncio
+import argparse
+from aiohttp import web
+
+from agent import history_qa_agent_ainvoke, get_agent, get_retrieval_stats
+from src import telemetry
+
+# --- CONFIGURATION ---
+MAX_CONCURRENT_TURNS = int(os.getenv("SERVER_MAX_CONCURRENT_TURNS", 8))  # turns talking to the LLM at once
+MAX_QUEUED_TURNS = int(os.getenv("SERVER_MAX_QUEUED_TURNS", 64))  # waiting turns before we answer 503
+TURN_TIMEOUT_SECONDS = int(os.getenv("SERVER_TURN_TIMEOUT_SECONDS", 120))
+MAX_SESSIONS = int(os.getenv("SERVER_MAX_SESSIONS", 10000))
+
+
+class SessionRegistry:
+    """Session id -> agent thread id, plus a lock so one session never runs two turns at once."""
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = {}  # session_id -> {"thread_id", "lock", "last_used"}
+
+    def create(self) -> str:
+        if len(self.sessions) >= self.max_sessions:
+            # forget the idlest session; its checkpointed thread simply stops being reachable
+            idle = min(self.sessions, key=lambda s: self.sessions[s]["last_used"])
+            del self.sessions[idle]
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = {"thread_id": f"http-{session_id}", "lock": asyncio.Lock(),
+                                     "last_used": time.monotonic()}
+        return session_id
+
+    def get(self, session_id: str):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session["last_used"] = time.monotonic()
+        return session
+
+
+class TurnLimiter:
+    """Semaphore with a bounded number of waiters: past that, callers are told to back off."""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TURNS, max_queued: int = MAX_QUEUED_TURNS):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_queued = max_queued
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    def saturated(self) -> bool:
+        return self.semaphore.locked() and self.waiting >= self.max_queued
+
+    async def __aenter__(self):
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.running -= 1
+        self.semaphore.release()
+
+
+# --- HANDLERS ---
+async def create_session(request):
+    session_id = request.app["sessions"].create()
+    return web.json_response({"session_id": session_id}, status=201)
+
+async def post_message(request):
+    session = request.app["sessions"].get(request.match_info["session_id"])
+    if session is None:
+        return web.json_response({"error": "unknown session"}, status=404)
+
+    try:
+        body = await request.json()
+    except ValueError:
+        return web.json_response({"error": "body must be JSON"}, status=400)
+    question = (body.get("question") or "").strip() if isinstance(body, dict) else ""
+    if not question:
+        return web.json_response({"error": "missing 'question'"}, status=400)
+
+    limiter = request.app["limiter"]
+    if limiter.saturated() or session["lock"].locked():
+        # BACKPRESSURE - refuse instead of letting requests (and memory) pile up
+        limiter.rejected += 1
+        return web.json_response({"error": "busy, retry later"}, status=503, headers={"Retry-After": "2"})
+
+    started = time.perf_counter()
+    try:
+        async with session["lock"], limiter:
+            response = await asyncio.wait_for(
+                history_qa_agent_ainvoke(question, session["thread_id"]), TURN_TIMEOUT_SECONDS
+            )
+    except asyncio.TimeoutError:
+        return web.json_response({"error": "the agent took too long to answer"}, status=504)
+    except Exception as e:
+        print(f"⚠️ Agent failure in session {request.match_info['session_id']}: {e}")
+        return web.json_response({"error": "agent failed to process the request"}, status=500)
+
+    return web.json_response({"answer": response.answer,
+                              "elapsed_seconds": round(time.perf_counter() - started, 3)})
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+async def stats(request):
+    limiter = request.app["limiter"]
+    return web.json_response({
+        "sessions": len(request.app["sessions"].sessions),
+        "running_turns": limiter.running,
+        "queued_turns": limiter.waiting,
+        "rejected_turns": limiter.rejected,
+        "retrieval": get_retrieval_stats(),
+        "telemetry": telemetry.report(),
+    })
+
+
+def build_app(max_concurrent: int = MAX_CONCURRENT_TURNS, max_queued: int = MAX_QUEUED_TURNS) -> web.Application:
+    app = web.Application()
+    app["sessions"] = SessionRegistry()
+    app["limiter"] = TurnLimiter(max_concurrent, max_queued)
+
+    async def warm_up(app):
+        # build the LLM client, Chroma store and graph before the first request arrives
+        await asyncio.to_thread(get_agent)
+
+    app.on_startup.append(warm_up)
+    app.add_routes([
+        web.post("/sessions", create_session),
+        web.post("/sessions/{session_id}/messages", post_message),
+        web.get("/health", health),
+        web.get("/stats", stats),
+    ])
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the history agent over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_TURNS,
+                        help="Agent turns allowed to call the LLM at the same time.")
+    parser.add_argument("--max-queued", type=int, default=MAX_QUEUED_TURNS,
+                        help="Turns allowed to wait for a slot before requests get a 503.")
+    args = parser.parse_args()
+
+    web.run_app(build_app(args.max_concurrent, args.max_queued), host=args.host, port=args.port)
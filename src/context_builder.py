@@ -0,0 +1,175 @@
+# Prompt context for search_history: merge overlapping chunks of the same page, drop repeated
+# boilerplate and near-duplicate passages, and fit what is left into a token budget
+
+import os
+import threading
+from typing import Any, List, Optional, Tuple
+
+try:
+    from src import telemetry  # imported by agent.py
+except ImportError:
+    import telemetry  # imported by the ingestion scripts in src/
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 400  # chunk_overlap is 200, but the splitter cuts on separators so it varies
+NEAR_DUPLICATE_JACCARD = 0.8
+SHINGLE_WORDS = 5
+MIN_TRUNCATED_TOKENS = 80  # don't bother adding a passage cut shorter than this
+
+
+def estimate_tokens(text: str) -> int:
+    """~4 characters per token; close enough for budgeting English web text."""
+    return (len(text) + 3) // 4
+
+
+def merge_overlap(first: str, second: str, max_overlap: int = MAX_OVERLAP_CHARS) -> Optional[str]:
+    """`first + second` without the repeated overlap if `second` continues `first`, else None."""
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return None
+    tail = first[-max_overlap:]
+    pos = tail.find(probe)
+    while pos != -1:
+        if second.startswith(tail[pos:]):
+            return first + second[len(tail) - pos:]
+        pos = tail.find(probe, pos + 1)
+    return None
+
+
+def _merge_pair(a: str, b: str) -> Optional[str]:
+    if b in a:
+        return a
+    if a in b:
+        return b
+    return merge_overlap(a, b) or merge_overlap(b, a)
+
+
+def _merge_source_chunks(chunks: List[Tuple[int, str]]) -> List[Tuple[int, str]]:
+    """(rank, text) chunks of one page -> contiguous passages, each keeping its best rank."""
+    segments = []
+    for rank, text in chunks:
+        segments.append([rank, text])
+        # a new chunk can bridge two passages, so keep merging until nothing changes
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(segments)):
+                for j in range(i + 1, len(segments)):
+                    joined = _merge_pair(segments[i][1], segments[j][1])
+                    if joined is not None:
+                        segments[i] = [min(segments[i][0], segments[j][0]), joined]
+                        del segments[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+    return [(rank, text) for rank, text in segments]
+
+
+def _shingles(text: str) -> set:
+    words = text.lower().split()
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+
+
+def _doc_fields(doc):
+    # dummy data is a dict, real data a langchain Document
+    if isinstance(doc, dict):
+        metadata, content = doc.get('metadata', {}), doc.get('page_content', '')
+    else:
+        metadata, content = doc.metadata, doc.page_content
+    return metadata, content or ''
+
+
+class ContextBuilder:
+    """Turns ranked retrieval hits into the passages that go into the prompt.
+
+    1. chunks of the same source are stitched back together and their overlap removed
+    2. lines already seen in a better-ranked passage (nav bars, footers, cookie banners) are dropped
+    3. passages that are near-duplicates of a kept one (5-word shingle Jaccard) are dropped
+    4. passages are added in rank order until `token_budget` is spent
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "tokens_in": 0, "tokens_out": 0,
+                         "merged_chunks": 0, "dropped_duplicates": 0, "truncated": 0}
+
+    def build(self, docs: List[Any], token_budget: Optional[int] = None) -> List[dict]:
+        """Returns passages as dicts with title, source, date and text, best first."""
+        budget = token_budget or self.token_budget
+        by_source, order = {}, []
+        for rank, doc in enumerate(docs):
+            metadata, content = _doc_fields(doc)
+            source = metadata.get('source') or f"doc-{rank}"
+            if source not in by_source:
+                by_source[source] = {"metadata": metadata, "chunks": []}
+                order.append(source)
+            by_source[source]["chunks"].append((rank, content))
+        tokens_in = sum(estimate_tokens(_doc_fields(doc)[1]) for doc in docs)
+
+        # 1. MERGE
+        passages = []
+        for source in order:
+            entry = by_source[source]
+            for rank, text in _merge_source_chunks(entry["chunks"]):
+                passages.append((rank, source, entry["metadata"], text))
+        passages.sort(key=lambda p: p[0])
+
+        # 2./3. BOILERPLATE + NEAR DUPLICATES
+        seen_lines, kept_shingles, cleaned, dropped = set(), [], [], 0
+        for rank, source, metadata, text in passages:
+            lines = []
+            for line in text.splitlines():
+                key = " ".join(line.lower().split())
+                if key and key in seen_lines:
+                    continue
+                if key:
+                    seen_lines.add(key)
+                lines.append(line)
+            text = "\n".join(lines).strip()
+            if not text:
+                dropped += 1
+                continue
+            shingles = _shingles(text)
+            if any(len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_JACCARD
+                   for other in kept_shingles):
+                dropped += 1
+                continue
+            kept_shingles.append(shingles)
+            cleaned.append((source, metadata, text))
+
+        # 4. BUDGET
+        result, used, truncated = [], 0, 0
+        for source, metadata, text in cleaned:
+            tokens = estimate_tokens(text)
+            if used + tokens > budget:
+                remaining = budget - used
+                if remaining < MIN_TRUNCATED_TOKENS:
+                    break
+                text = text[:remaining * 4].rsplit(" ", 1)[0] + " ..."
+                tokens = estimate_tokens(text)
+                truncated += 1
+            result.append({"title": metadata.get('title'), "source": metadata.get('source'),
+                           "date": metadata.get('date'), "text": text})
+            used += tokens
+            if used >= budget:
+                break
+
+        with self._lock:
+            self.counters["calls"] += 1
+            self.counters["tokens_in"] += tokens_in
+            self.counters["tokens_out"] += used
+            self.counters["merged_chunks"] += len(docs) - len(passages)
+            self.counters["dropped_duplicates"] += dropped
+            self.counters["truncated"] += truncated
+        telemetry.count("context.tokens_in", tokens_in)
+        telemetry.count("context.tokens_out", used)
+        return result
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+        stats["saved_ratio"] = stats["tokens_saved"] / stats["tokens_in"] if stats["tokens_in"] else 0.0
+        return stats
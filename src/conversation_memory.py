@@ -0,0 +1,329 @@
+# Conversation memory for the agent: a SQLite checkpointer that survives restarts and forgets idle
+# threads, plus compaction of past turns so each model call gets a bounded prompt
+
+import os
+import re
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import HumanMessage, RemoveMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "./data/conversations.sqlite3")
+CONVERSATION_TTL_SECONDS = int(os.getenv("CONVERSATION_TTL_DAYS", 30)) * 24 * 3600
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", 1000))
+KEEP_CHECKPOINTS = 2  # per thread; older checkpoints are only useful for time travel, which we don't do
+EVICT_EVERY = 100  # puts between TTL sweeps
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 4000))  # past turns sent with each request
+COMPACTED_TOOL_CHARS = int(os.getenv("COMPACTED_TOOL_CHARS", 600))
+COMPACTED_PREFIX = "[compacted] "
+
+
+class SqliteCheckpointer(BaseCheckpointSaver):
+    """Durable replacement for InMemorySaver.
+
+    Only the latest KEEP_CHECKPOINTS checkpoints of each thread are kept, and threads idle for
+    longer than `ttl_seconds` (or beyond the `max_threads` most recent) are deleted.
+    """
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH, ttl_seconds: int = CONVERSATION_TTL_SECONDS,
+                 max_threads: int = MAX_CONVERSATIONS):
+        super().__init__()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.max_threads = max_threads
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.puts_since_evict = 0
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                type TEXT,
+                checkpoint BLOB,
+                metadata_type TEXT,
+                metadata BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL DEFAULT '',
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT,
+                value BLOB,
+                task_path TEXT NOT NULL DEFAULT '',
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS threads (
+                thread_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_threads_last_used ON threads (last_used);
+        """)
+        self.evict()
+
+    # --- READS ---
+    def _load_tuple(self, row) -> CheckpointTuple:
+        thread_id, ns, checkpoint_id, parent_id, type_, blob, metadata_type, metadata = row
+        writes = self.conn.execute("""
+            SELECT task_id, channel, type, value FROM writes
+            WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+            ORDER BY task_id, idx
+        """, (thread_id, ns, checkpoint_id)).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            checkpoint=self.serde.loads_typed((type_, blob)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            ),
+            pending_writes=[(task_id, channel, self.serde.loads_typed((wtype, value)))
+                            for task_id, channel, wtype, value in writes],
+        )
+
+    def get_tuple(self, config) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        columns = ("thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                   "type, checkpoint, metadata_type, metadata")
+        with self.lock:
+            if checkpoint_id:
+                row = self.conn.execute(f"""
+                    SELECT {columns} FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?
+                """, (thread_id, ns, checkpoint_id)).fetchone()
+            else:
+                row = self.conn.execute(f"""
+                    SELECT {columns} FROM checkpoints
+                    WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT 1
+                """, (thread_id, ns)).fetchone()
+            return self._load_tuple(row) if row else None
+
+    def list(self, config, *, filter: Optional[dict] = None, before=None,
+             limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+        if before and get_checkpoint_id(before):
+            clauses.append("checkpoint_id < ?")
+            params.append(get_checkpoint_id(before))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.lock:
+            rows = self.conn.execute(f"""
+                SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                       type, checkpoint, metadata_type, metadata
+                FROM checkpoints {where}
+                ORDER BY checkpoint_id DESC
+            """, params).fetchall()
+            tuples = [self._load_tuple(row) for row in rows]
+
+        returned = 0
+        for checkpoint_tuple in tuples:
+            if filter and any(checkpoint_tuple.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            returned += 1
+            if limit is not None and returned >= limit:
+                break
+
+    # --- WRITES ---
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        type_, blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self.lock:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO checkpoints
+                    (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                     type, checkpoint, metadata_type, metadata)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (thread_id, ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                  type_, blob, metadata_type, metadata_blob))
+            self._prune_thread(thread_id, ns)
+            self.conn.execute("INSERT OR REPLACE INTO threads (thread_id, last_used) VALUES (?, ?)",
+                              (thread_id, time.time()))
+            self.conn.commit()
+
+        self.puts_since_evict += 1
+        if self.puts_since_evict >= EVICT_EVERY:
+            self.evict()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        # special channels (errors, interrupts) overwrite, regular writes are kept once
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx),
+                         channel, type_, blob, task_path))
+        with self.lock:
+            self.conn.executemany(f"""
+                {verb} INTO writes
+                    (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            self.conn.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self.lock:
+            self._delete_threads([thread_id])
+            self.conn.commit()
+
+    def get_next_version(self, current, channel) -> str:
+        # same string versions as InMemorySaver, so stores written by either stay comparable
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # --- EVICTION ---
+    def _prune_thread(self, thread_id: str, ns: str):
+        stale = [row[0] for row in self.conn.execute("""
+            SELECT checkpoint_id FROM checkpoints
+            WHERE thread_id = ? AND checkpoint_ns = ?
+            ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?
+        """, (thread_id, ns, KEEP_CHECKPOINTS))]
+        for table in ("checkpoints", "writes"):
+            self.conn.executemany(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                [(thread_id, ns, checkpoint_id) for checkpoint_id in stale]
+            )
+
+    def _delete_threads(self, thread_ids: List[str]):
+        for table in ("checkpoints", "writes", "threads"):
+            self.conn.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in thread_ids])
+
+    def evict(self) -> int:
+        """Drop threads idle for longer than the TTL, then the oldest ones beyond max_threads."""
+        self.puts_since_evict = 0
+        with self.lock:
+            expired = [row[0] for row in self.conn.execute(
+                "SELECT thread_id FROM threads WHERE last_used < ?", (time.time() - self.ttl_seconds,)
+            )]
+            expired += [row[0] for row in self.conn.execute("""
+                SELECT thread_id FROM threads WHERE last_used >= ?
+                ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            """, (time.time() - self.ttl_seconds, self.max_threads))]
+            if expired:
+                self._delete_threads(expired)
+                self.conn.commit()
+        if expired:
+            print(f"Evicted {len(expired)} idle conversations.")
+        return len(expired)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- ASYNC (server.py) ---
+    # SQLite calls are short; run them in a worker thread so the event loop never blocks on disk
+    async def aget_tuple(self, config) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter: Optional[dict] = None, before=None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+# --- HISTORY COMPACTION ---
+def compact_tool_output(content: str, max_chars: int = COMPACTED_TOOL_CHARS) -> str:
+    """Keep the dates, titles and domains of a tool result and drop the page text."""
+    text = re.sub(r"CONTENT:.*?(?=\n\n---\n\n|\n\nDOMAINS FOUND:|\Z)", "", content, flags=re.S)
+    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit("\n", 1)[0] + "\n..."
+    return COMPACTED_PREFIX + text
+
+def compact_messages(messages: List[Any], token_budget: int = HISTORY_TOKEN_BUDGET) -> List[Any]:
+    """State updates that shrink everything before the current question.
+
+    Tool results of past turns are replaced by `compact_tool_output` (same message id, so the
+    checkpoint is rewritten too), then whole past turns are removed oldest first until they fit
+    in `token_budget`. The current turn is never touched.
+    """
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(turn_starts) < 2:
+        return []
+    current = turn_starts[-1]
+
+    updates, past = [], []
+    for message in messages[:current]:
+        if (isinstance(message, ToolMessage) and isinstance(message.content, str)
+                and not message.content.startswith(COMPACTED_PREFIX)
+                and len(message.content) > COMPACTED_TOOL_CHARS):
+            message = ToolMessage(content=compact_tool_output(message.content), id=message.id,
+                                  tool_call_id=message.tool_call_id, name=message.name)
+            updates.append(message)
+        past.append(message)
+
+    # drop whole turns so no tool call is left without its result
+    bounds = [0] + turn_starts[1:]
+    turns = [past[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+    total = count_tokens_approximately(past)
+    removed = set()
+    for turn in turns:
+        if total <= token_budget:
+            break
+        total -= count_tokens_approximately(turn)
+        removed.update(m.id for m in turn)
+
+    updates = [m for m in updates if m.id not in removed]
+    updates += [RemoveMessage(id=message_id) for message_id in removed]
+    return updates
+
+def compaction_middleware(token_budget: int = HISTORY_TOKEN_BUDGET):
+    """`before_model` hook for create_agent that applies compact_messages to the graph state."""
+    from langchain.agents.middleware import AgentState, before_model
+
+    @before_model
+    def compact_history(state: AgentState, runtime) -> Optional[dict]:
+        updates = compact_messages(state["messages"], token_budget)
+        return {"messages": updates} if updates else None
+
+    return compact_history
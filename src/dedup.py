@@ -0,0 +1,173 @@
+# Duplicate suppression for ingestion: canonical URLs before fetching, SimHash fingerprints of page
+# text and exact hashes of chunk text before embedding. Near-duplicate pages (same article under another URL,
+# search/pagination pages) are not fetched or embedded twice, nor are chunks repeated within a page.
+
+import os
+import re
+import hashlib
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+# query parameters that only say how the visitor got there
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'mc_cid', 'mc_eid', 'igshid',
+                   '_ga', '_gl', 'ref_src', 'ref_url', 'spm', 'srsltid'}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'hsa_', 'oly_')
+# share-link parameters that are only tracking on these hosts (elsewhere `si` can mean anything)
+HOST_TRACKING_PARAMS = {'youtube.com': {'si', 'feature', 'pp'}, 'youtu.be': {'si', 'feature'},
+                        'open.spotify.com': {'si'}, 'music.apple.com': {'ls'}}
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+NEAR_DUPLICATE_BITS = int(os.getenv("NEAR_DUPLICATE_BITS", 8))  # max differing SimHash bits (of 64)
+SHINGLE_WORDS = 2
+MIN_SHINGLES = 8  # shorter texts are only matched exactly, their SimHash is too noisy
+FINGERPRINT_BITS = 64
+# content hash recorded for suppressed pages: never equal to a real hash, so a suppressed page is
+# not "unchanged" and is checked again the next time it is visited
+SUPPRESSED_PAGE_HASH = ""
+
+_WORD_RE = re.compile(r"\w+")
+
+
+# --- URLS ---
+def canonical_url(url: str) -> str:
+    """Lowercase scheme/host, no default port, no fragment, no tracking parameters.
+
+    Path and the remaining `key[=value]` segments are kept byte for byte, in their order: the result
+    is still a URL that fetches the same page.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    hostname = host = (parts.hostname or '').rstrip('.')
+    if port and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if parts.username:
+        host = f"{parts.username}{':' + parts.password if parts.password else ''}@{host}"
+
+    host_params = HOST_TRACKING_PARAMS.get(hostname.removeprefix('www.').removeprefix('m.'), ())
+    kept = []
+    for segment in parts.query.split('&'):
+        key = unquote_plus(segment.split('=', 1)[0]).lower()
+        if segment and key not in TRACKING_PARAMS and key not in host_params \
+                and not key.startswith(TRACKING_PREFIXES):
+            kept.append(segment)
+    query = '&'.join(kept)
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+# --- SIMHASH ---
+# Each shingle hash is added to 64 counters at once: bit i of the hash is spread to bit i*LANE of a
+# big integer, so one addition per byte of hash replaces 64 per-bit updates.
+_LANE = 24  # bits per counter, enough for 16M shingles
+_SPREAD = [[sum(1 << ((8 * k + j) * _LANE) for j in range(8) if byte >> j & 1) for byte in range(256)]
+           for k in range(FINGERPRINT_BITS // 8)]
+_LANE_MASK = (1 << _LANE) - 1
+
+
+def _shingle_hashes(text: str):
+    words = _WORD_RE.findall(text.lower())
+    for i in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+        shingle = " ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8", errors="replace")
+        yield hashlib.blake2b(shingle, digest_size=FINGERPRINT_BITS // 8).digest()
+
+
+def simhash(text: str):
+    """64-bit SimHash over word 2-shingles, or None when the text is too short to fingerprint."""
+    lanes, shingles = 0, 0
+    for digest in _shingle_hashes(text):
+        shingles += 1
+        for k, byte in enumerate(digest):
+            lanes += _SPREAD[k][byte]
+    if shingles < MIN_SHINGLES:
+        return None
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        if 2 * ((lanes >> (bit * _LANE)) & _LANE_MASK) > shingles:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class SimHashIndex:
+    """Fingerprints seen so far, searchable by Hamming distance.
+
+    Fingerprints are cut into max_bits + 1 bands; two fingerprints within max_bits of each other
+    agree exactly on at least one band, so only fingerprints sharing a band are compared.
+    """
+
+    def __init__(self, max_bits: int = NEAR_DUPLICATE_BITS):
+        self.max_bits = max_bits
+        bands = max_bits + 1
+        width = FINGERPRINT_BITS // bands
+        self.bands = [(i * width, width if i < bands - 1 else FINGERPRINT_BITS - i * width)
+                      for i in range(bands)]
+        self.buckets = [{} for _ in self.bands]
+
+    def _keys(self, fingerprint: int):
+        return [(fingerprint >> shift) & ((1 << width) - 1) for shift, width in self.bands]
+
+    def add_if_new(self, fingerprint: int) -> bool:
+        """False if a near-duplicate is already indexed, otherwise index `fingerprint` and return True."""
+        keys = self._keys(fingerprint)
+        for buckets, key in zip(self.buckets, keys):
+            for other in buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_bits:
+                    return False
+        for buckets, key in zip(self.buckets, keys):
+            buckets.setdefault(key, []).append(fingerprint)
+        return True
+
+
+def fingerprint_page(text: str):
+    """Page SimHash - computed in the transform workers."""
+    return simhash(text)
+
+
+# --- PIPELINE ---
+class Deduplicator:
+    """Per-run duplicate filter for the ingestion stream, with counts of what it suppressed."""
+
+    def __init__(self, max_bits: int = NEAR_DUPLICATE_BITS):
+        self.urls = set()
+        self.pages = SimHashIndex(max_bits)
+        self.counts = {'duplicate_urls': 0, 'near_duplicate_pages': 0, 'duplicate_chunks': 0}
+
+    def first_visit(self, url: str) -> bool:
+        """True the first time a canonical URL is seen (records arrive newest visit first)."""
+        if url in self.urls:
+            self.counts['duplicate_urls'] += 1
+            return False
+        self.urls.add(url)
+        return True
+
+    def add_page(self, fingerprint):
+        """Index a page that stays in the store without being re-indexed (unchanged since last run)."""
+        if fingerprint is not None:
+            self.pages.add_if_new(fingerprint)
+
+    def is_near_duplicate_page(self, fingerprint) -> bool:
+        if fingerprint is None or self.pages.add_if_new(fingerprint):
+            return False
+        self.counts['near_duplicate_pages'] += 1
+        return True
+
+    def unique_chunks(self, splits):
+        """Splits whose exact text did not already occur earlier in the same page.
+
+        Only within the page: chunk IDs and stale deletion are per page, so a chunk dropped in favour
+        of another page's copy would be lost as soon as that page changed. Exact hashes are enough
+        here (site boilerplate repeats verbatim) and cost far less than a SimHash per chunk.
+        """
+        kept, seen = [], set()
+        for split in splits:
+            key = hashlib.sha1(split.page_content.encode("utf-8", errors="replace")).digest()
+            if key in seen:
+                self.counts['duplicate_chunks'] += 1
+            else:
+                seen.add(key)
+                kept.append(split)
+        return kept
+
+    def stats(self) -> dict:
+        return dict(self.counts)
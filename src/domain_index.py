@@ -0,0 +1,190 @@
+# Compact domain -> URL aggregate table (titles, visit counts, first/last visit) plus one row per
+# visit, kept by ingestion so link/domain questions are answered with SQL instead of vector search
+
+import os
+import sqlite3
+import threading
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urlparse
+
+DOMAINS_FILENAME = "domains.sqlite3"
+
+TimeRange = Tuple[Optional[int], Optional[int]]  # unix seconds, start inclusive / end exclusive
+
+
+def domain_of(url: str) -> str:
+    try:
+        netloc = urlparse(url).netloc.lower()
+    except ValueError:
+        return ""
+    return netloc[4:] if netloc.startswith("www.") else netloc
+
+
+def _time_clause(time_range: Optional[TimeRange], column: str = "v.visit_ts"):
+    clauses, params = [], []
+    if time_range and time_range[0] is not None:
+        clauses.append(f"{column} >= ?")
+        params.append(time_range[0])
+    if time_range and time_range[1] is not None:
+        clauses.append(f"{column} < ?")
+        params.append(time_range[1])
+    return clauses, params
+
+
+class DomainIndex:
+    """SQLite table stored next to the vector store; one row per visited URL, indexed by domain."""
+
+    def __init__(self, persist_directory: str):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, DOMAINS_FILENAME)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_visits = []
+        self.pending_sources = []
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                title TEXT,
+                visit_count INTEGER NOT NULL DEFAULT 0,
+                first_visit_ts INTEGER,
+                last_visit_ts INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_urls_domain ON urls (domain, visit_count DESC);
+            CREATE INDEX IF NOT EXISTS idx_urls_last_visit ON urls (last_visit_ts);
+            -- every known visit, so date-range questions count visits inside the range
+            CREATE TABLE IF NOT EXISTS visits (
+                url TEXT NOT NULL,
+                visit_ts INTEGER NOT NULL,
+                PRIMARY KEY (url, visit_ts)
+            ) WITHOUT ROWID;
+            -- Chrome URLs folded into one canonical URL (tracking parameters, fragments...); each
+            -- keeps its own visit count and urls.visit_count is their sum
+            CREATE TABLE IF NOT EXISTS url_sources (
+                url TEXT NOT NULL,
+                source_url TEXT NOT NULL,
+                visit_count INTEGER NOT NULL,
+                PRIMARY KEY (url, source_url)
+            ) WITHOUT ROWID;
+        """)
+
+    # --- WRITES (ingestion) ---
+    def add_visit(self, record: dict, flush_every: int = 1000):
+        """Buffer one history record.
+
+        Chrome's visit_count is a running total per Chrome URL (`source_url`, before canonical_url), so
+        the max wins per source URL and the canonical URL counts the sum over its sources.
+        `visit_times` (extract_urls) lists every visit of the record's range; records without it
+        count as one visit at `visit_ts`.
+        """
+        visit_ts = record.get('visit_ts')
+        self.pending.append((
+            record['url'], domain_of(record['url']), record.get('title'),
+            record.get('visit_count') or 1,
+            record.get('first_visit_ts', visit_ts), visit_ts
+        ))
+        self.pending_sources.append((record['url'], record.get('source_url', record['url']),
+                                     record.get('visit_count') or 1))
+        visit_times = record.get('visit_times') or ([visit_ts] if visit_ts is not None else [])
+        self.pending_visits.extend((record['url'], ts) for ts in visit_times)
+        if len(self.pending) >= flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.lock:
+            self.conn.executemany("""
+                INSERT INTO urls (url, domain, title, visit_count, first_visit_ts, last_visit_ts)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    title = COALESCE(excluded.title, title),
+                    visit_count = MAX(visit_count, excluded.visit_count),
+                    first_visit_ts = MIN(COALESCE(first_visit_ts, excluded.first_visit_ts),
+                                         COALESCE(excluded.first_visit_ts, first_visit_ts)),
+                    last_visit_ts = MAX(COALESCE(last_visit_ts, excluded.last_visit_ts),
+                                        COALESCE(excluded.last_visit_ts, last_visit_ts))
+            """, self.pending)
+            self.conn.executemany("""
+                INSERT INTO url_sources (url, source_url, visit_count) VALUES (?, ?, ?)
+                ON CONFLICT(url, source_url) DO UPDATE SET visit_count = MAX(visit_count, excluded.visit_count)
+            """, self.pending_sources)
+            self.conn.executemany("""
+                UPDATE urls SET visit_count = (SELECT SUM(visit_count) FROM url_sources s WHERE s.url = urls.url)
+                WHERE url = ?
+            """, [(url,) for url in {url for url, _, _ in self.pending_sources}])
+            # re-ingesting an overlapping range sees the same visits again
+            self.conn.executemany("INSERT OR IGNORE INTO visits (url, visit_ts) VALUES (?, ?)",
+                                  self.pending_visits)
+            self.conn.commit()
+        self.pending, self.pending_visits, self.pending_sources = [], [], []
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+
+    # --- READS (agent) ---
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def domain_summaries(self, domains: List[str], time_range: Optional[TimeRange] = None) -> List[dict]:
+        """Totals for each domain, in the order given: over the whole history (Chrome's visit
+        counts), or over the visits inside `time_range`."""
+        if not domains:
+            return []
+        in_domains = f"domain IN ({','.join('?' * len(domains))})"
+        with self.lock:
+            if time_range:
+                clauses, params = _time_clause(time_range)
+                rows = self.conn.execute(f"""
+                    SELECT u.domain, COUNT(DISTINCT u.url), COUNT(*), MIN(v.visit_ts), MAX(v.visit_ts)
+                    FROM urls u JOIN visits v ON v.url = u.url
+                    WHERE u.{in_domains} AND {' AND '.join(clauses)}
+                    GROUP BY u.domain
+                """, (*domains, *params)).fetchall()
+            else:
+                rows = self.conn.execute(f"""
+                    SELECT domain, COUNT(*), SUM(visit_count), MIN(first_visit_ts), MAX(last_visit_ts)
+                    FROM urls
+                    WHERE {in_domains}
+                    GROUP BY domain
+                """, domains).fetchall()
+        by_domain = {
+            row[0]: {'domain': row[0], 'pages': row[1], 'visits': row[2],
+                     'first_visit_ts': row[3], 'last_visit_ts': row[4]}
+            for row in rows
+        }
+        return [by_domain[d] for d in domains if d in by_domain]
+
+    def top_urls(self, domain: str, limit: int = 3, prefer: Iterable[str] = (),
+                 time_range: Optional[TimeRange] = None) -> List[dict]:
+        """Most visited URLs of a domain (within `time_range`, if given); URLs listed in `prefer`
+        (e.g. retrieval hits) come first."""
+        prefer = list(prefer)
+        order = "visits DESC, last_visit DESC"
+        if prefer:
+            order = f"u.url IN ({','.join('?' * len(prefer))}) DESC, {order}"
+        with self.lock:
+            if time_range:
+                clauses, params = _time_clause(time_range)
+                rows = self.conn.execute(f"""
+                    SELECT u.url, u.title, COUNT(*) AS visits, MAX(v.visit_ts) AS last_visit
+                    FROM urls u JOIN visits v ON v.url = u.url
+                    WHERE u.domain = ? AND {' AND '.join(clauses)}
+                    GROUP BY u.url
+                    ORDER BY {order}
+                    LIMIT ?
+                """, (domain, *params, *prefer, limit)).fetchall()
+            else:
+                rows = self.conn.execute(f"""
+                    SELECT u.url, u.title, u.visit_count AS visits, u.last_visit_ts AS last_visit
+                    FROM urls u
+                    WHERE u.domain = ?
+                    ORDER BY {order}
+                    LIMIT ?
+                """, (domain, *prefer, limit)).fetchall()
+        return [{'url': url, 'title': title, 'visits': visits, 'last_visit_ts': last}
+                for url, title, visits, last in rows]
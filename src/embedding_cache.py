@@ -0,0 +1,138 @@
+# On-disk embedding cache keyed by (model, chunk text hash), shared by every vector store
+
+import os
+import time
+import sqlite3
+import hashlib
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+try:
+    from src import telemetry  # imported as src.* (agent.py, bench/run.py)
+except ImportError:
+    import telemetry  # run as a script from src/
+
+CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./data/embedding_cache.sqlite3")
+MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500_000))
+LOOKUP_BATCH_SIZE = 500  # stays under SQLite's bound-parameter limit
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+def model_name(embeddings: Embeddings) -> str:
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps another Embeddings and only sends texts it has never seen to it.
+
+    Vectors are stored as float32 blobs. When the cache grows past max_entries the
+    least recently used rows are evicted.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model = model_name(embeddings)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self.conn.commit()
+
+    # --- LOOKUPS ---
+    def _lookup(self, hashes):
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), LOOKUP_BATCH_SIZE):
+            batch = unique[i:i + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model, *batch]
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, self.model, h) for h in found]
+            )
+        return found
+
+    def _store(self, hashes, vectors):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+            [(self.model, h, np.asarray(v, dtype=np.float32).tobytes(), now) for h, v in zip(hashes, vectors)]
+        )
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (overflow,)
+            )
+
+    # --- EMBEDDINGS INTERFACE ---
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        found = self._lookup(hashes)
+
+        # texts repeated inside the same call (boilerplate) are only embedded once
+        missing = {}
+        for h, t in zip(hashes, texts):
+            if h not in found and h not in missing:
+                missing[h] = t
+
+        # every text that is not embedded now is a hit, repeats of a missed text included
+        hits = len(texts) - len(missing)
+        self.hits += hits
+        self.misses += len(missing)
+        telemetry.count("embed.cache_hits", hits)
+        telemetry.count("embed.texts", len(missing))
+
+        if missing:
+            with telemetry.span("embed.documents"):
+                new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self._store(list(missing.keys()), new_vectors)
+            found.update(zip(missing.keys(), new_vectors))
+        else:
+            self.conn.commit()  # persist last_used updates
+
+        return [list(found[h]) for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
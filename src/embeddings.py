@@ -0,0 +1,114 @@
+# Embedding backends: OpenAI (default) or a local CPU model (all-MiniLM-L6-v2 through onnxruntime,
+# the same model chromadb ships). The backend is recorded on the Chroma collection so a store
+# indexed with one backend is never queried with the other.
+
+import os
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+try:
+    from src import telemetry  # imported by agent.py
+except ImportError:
+    import telemetry  # imported by the ingestion scripts in src/
+
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "openai")  # "openai" or "local"
+LOCAL_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", 256))  # texts per embed.local_batch span
+
+OPENAI_DIMENSIONS = {"text-embedding-ada-002": 1536, "text-embedding-3-small": 1536,
+                     "text-embedding-3-large": 3072}
+LOCAL_MODEL_NAME = "all-MiniLM-L6-v2"
+LOCAL_DIMENSION = 384
+
+
+class LocalOnnxEmbeddings(Embeddings):
+    """all-MiniLM-L6-v2 on CPU, no network after the one-time model download.
+
+    One onnxruntime session, called from one thread: its intra-op thread pool already uses every
+    core, and chromadb pads each input to 256 tokens, so batches are simply consecutive texts.
+    """
+
+    model = LOCAL_MODEL_NAME  # also the key embedding_cache stores vectors under
+
+    def __init__(self, batch_size: int = LOCAL_BATCH_SIZE):
+        from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+        self._model = ONNXMiniLM_L6_V2(preferred_providers=["CPUExecutionProvider"])
+        self.batch_size = batch_size
+        # downloads the model to ~/.cache/chroma (unlocked, so never from concurrent callers) and
+        # builds the session once, here
+        self._model(["warm up"])
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        with telemetry.span("embed.local_batch"):
+            return [vector.tolist() for vector in self._model(texts)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+
+def get_embedding_backend(name: str = EMBEDDING_BACKEND) -> Embeddings:
+    if name == "local":
+        return LocalOnnxEmbeddings()
+    if name == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{name}' (expected 'openai' or 'local').")
+
+
+# stores without a stamp were all built with OpenAI embeddings
+LEGACY_METADATA = {"embedding_backend": "openai"}
+
+
+def backend_metadata(embeddings: Embeddings) -> dict:
+    """What gets stamped on the Chroma collection."""
+    if isinstance(embeddings, LocalOnnxEmbeddings):
+        return {"embedding_backend": "local", "embedding_model": LOCAL_MODEL_NAME,
+                "embedding_dim": LOCAL_DIMENSION}
+    model = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dim = getattr(embeddings, "dimensions", None) or OPENAI_DIMENSIONS.get(model, 0)
+    return {"embedding_backend": "openai", "embedding_model": model, "embedding_dim": dim}
+
+
+def check_metadata(recorded: dict, embeddings: Embeddings, store_name: str):
+    """Raise if `recorded` (a store's stamp) names another backend, model or dimension."""
+    expected = backend_metadata(embeddings)
+    if "embedding_backend" not in recorded:
+        recorded = LEGACY_METADATA
+    for key in ("embedding_backend", "embedding_model", "embedding_dim"):
+        if key in recorded and recorded[key] != expected[key]:
+            raise ValueError(
+                f"{store_name} was indexed with {recorded.get('embedding_backend')} "
+                f"embeddings ({recorded.get('embedding_model', 'unknown model')}, "
+                f"{recorded.get('embedding_dim', '?')} dims) but {expected['embedding_backend']} "
+                f"({expected['embedding_model']}, {expected['embedding_dim']} dims) is configured. "
+                f"Set EMBEDDING_BACKEND to match or re-index into a new directory."
+            )
+
+
+def check_collection(vector_store, embeddings: Embeddings):
+    """check_metadata for a Chroma collection; read-only, so the agent can call it."""
+    collection = vector_store._collection
+    metadata = dict(collection.metadata or {})
+    if "embedding_backend" in metadata or collection.count():
+        check_metadata(metadata, embeddings, f"Collection '{collection.name}'")
+
+
+def stamp_collection(vector_store, stamp: dict):
+    """Record `stamp` (backend_metadata, or LEGACY_METADATA) on a Chroma collection.
+
+    Writes to the store, so only the ingestion scripts call it, after check_collection.
+    """
+    collection = vector_store._collection
+    metadata = dict(collection.metadata or {})
+    if any(metadata.get(key) != value for key, value in stamp.items()):
+        metadata = {k: v for k, v in metadata.items() if not k.startswith("hnsw:")}
+        collection.modify(metadata={**metadata, **stamp})
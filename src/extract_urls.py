@@ -1,26 +1,53 @@
 # (URLs + titles + timestamps)
 
 # import libraries
+import os
+import sys
+import queue
+import heapq
+import shutil
 import sqlite3
-import numpy as np
-np.float_ = np.float64
+import tempfile
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 
+try:
+    from src import telemetry  # imported as src.* (agent.py, bench/run.py)
+except ImportError:
+    import telemetry  # run as a script from src/
+
 
-PROJECT_DIR = Path("/Users/valesanchez/Documents/Cursor/nora")
-DB_FILE = PROJECT_DIR / "data" / "history_copy.db"
 CHROME_EPOCH = datetime(1601, 1, 1) # starting data from 1601
+UNIX_EPOCH_IN_CHROME_SECONDS = 11644473600 # seconds between 1601-01-01 and 1970-01-01
+FETCH_SIZE = int(os.getenv("HISTORY_FETCH_SIZE", 1000))  # rows per fetchmany()
+PREFETCH_ROWS = 4 * FETCH_SIZE  # per profile, buffered ahead of the merge
+
+
+# --- HISTORY FILES ---
+def chrome_user_data_dir() -> Path:
+    if os.getenv("CHROME_USER_DATA_DIR"):
+        return Path(os.getenv("CHROME_USER_DATA_DIR"))
+    home = Path.home()
+    if sys.platform == "darwin":
+        return home / "Library" / "Application Support" / "Google" / "Chrome"
+    if sys.platform.startswith("win"):
+        return Path(os.getenv("LOCALAPPDATA", home)) / "Google" / "Chrome" / "User Data"
+    return home / ".config" / "google-chrome"
 
-# if PROJECT_DIR.is_dir():
-#     print(f"'{PROJECT_DIR}' is a directory.")
-# else:
-#     print(f"'{PROJECT_DIR}' is not a directory.")
+def chrome_profile_histories(user_data_dir: Path = None):
+    """The History file of every Chrome profile ("Default", "Profile 1", ...)."""
+    user_data_dir = user_data_dir or chrome_user_data_dir()
+    candidates = [user_data_dir / "Default" / "History"] + sorted(user_data_dir.glob("Profile */History"))
+    return [path for path in candidates if path.is_file()]
 
-# if DB_FILE.is_file():
-#     print(f"'{DB_FILE}' is a file.")
-# else:
-#     print(f"'{DB_FILE}' is not a file.")
+def default_history_files():
+    """CHROME_HISTORY_DB (one path, or several joined by os.pathsep) wins over profile discovery."""
+    if os.getenv("CHROME_HISTORY_DB"):
+        return [Path(p) for p in os.getenv("CHROME_HISTORY_DB").split(os.pathsep) if p]
+    return chrome_profile_histories()
+
+HISTORY_FILES = default_history_files()
 
 def convert_chrome_time_to_datetime(chrome_time: int) -> datetime:
     if chrome_time is None:
@@ -31,55 +58,177 @@ def convert_datetime_to_chrome(dt: datetime) -> int:
     difference = dt - CHROME_EPOCH
     return int(difference.total_seconds() * 1000000)
 
+def convert_chrome_time_to_epoch(chrome_time: int) -> int:
+    """Unix seconds, the numeric form stored in chunk metadata for date-range filters."""
+    if chrome_time is None:
+        return None
+    return chrome_time // 1000000 - UNIX_EPOCH_IN_CHROME_SECONDS
 
-def get_history_data(start_date_str, end_date_str):
-    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-    
-    start_chrome_time = convert_datetime_to_chrome(start_date)
-    end_chrome_time = convert_datetime_to_chrome(end_date)
-    
+
+def _row_to_record(row):
+    url, title, chrome_time, visit_count, first_visit_time, visits_in_range, visit_times = row
+    legible_date = convert_chrome_time_to_datetime(chrome_time)
+    return {
+        "url": url,
+        "title": title,
+        "date": legible_date.isoformat(),
+        "visit_ts": convert_chrome_time_to_epoch(chrome_time),
+        "first_visit_ts": convert_chrome_time_to_epoch(first_visit_time),
+        "last_visit_time": chrome_time,  # raw Chrome timestamp, used as the ingestion watermark
+        "visit_count": visit_count,  # Chrome's all-time total
+        "visits_in_range": visits_in_range,
+        # every visit in the range, for the domain table's per-range counts
+        "visit_times": [convert_chrome_time_to_epoch(int(t)) for t in visit_times.split(",")]
+    }
+
+def _snapshot(path: Path, directory: str) -> Path:
+    """Copy a History file and its -wal / -journal into `directory`.
+
+    Chrome keeps its History database locked while it runs, and recent visits may still sit in the
+    write-ahead log, so the live file can be neither opened nor read on its own. SQLite applies the
+    copied log (or rolls back a half-written transaction) when the copy is opened, and Chrome's
+    files are never touched.
+    """
+    path = Path(path)
+    target = Path(directory) / "History"
+    shutil.copyfile(path, target)
+    for suffix in ("-wal", "-journal"):
+        sidecar = path.with_name(path.name + suffix)
+        if sidecar.exists():
+            shutil.copyfile(sidecar, target.with_name(target.name + suffix))
+    return target
+
+def _iter_profile(path, visit_clause, params, fetch_size=FETCH_SIZE):
+    """One record per URL visited in the range, newest visit first.
+
+    Ranges are matched against every row of `visits`, not `urls.last_visit_time`, so a page read in
+    March and again in June still shows up when asking for March.
+    """
     conn = None
-    data_for_langchain = []
-    
+    snapshot_dir = tempfile.TemporaryDirectory(prefix="chrome-history-")
+
     try:
-        conn = sqlite3.connect(DB_FILE)
+        with telemetry.span("history.snapshot"):
+            conn = sqlite3.connect(_snapshot(path, snapshot_dir.name))
         cursor = conn.cursor()
         
         query = f"""
-            SELECT url, title, last_visit_time
-            FROM urls
-            WHERE last_visit_time BETWEEN {start_chrome_time} AND {end_chrome_time}
-            ORDER BY last_visit_time DESC
+            SELECT u.url, u.title, MAX(v.visit_time) AS last_visit, u.visit_count,
+                   MIN(v.visit_time), COUNT(*), GROUP_CONCAT(v.visit_time)
+            FROM visits v JOIN urls u ON u.id = v.url
+            WHERE {visit_clause}
+            GROUP BY v.url
+            ORDER BY last_visit DESC
         """# change this query to certain url history for confidential reasons
         
-        cursor.execute(query)
-        results = cursor.fetchall()
+        with telemetry.span("history.query"):
+            cursor.execute(query, params)
 
-        
-        for row in results:
-            url, title, chrome_time = row
-            legible_date = convert_chrome_time_to_datetime(chrome_time)
-            
+        # stream rows instead of fetchall() so large histories never sit in memory at once
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            telemetry.count("history.rows", len(rows))
             # collection the urls and the relevant metadata
-            data_for_langchain.append({
-                "url": url,
-                "title": title,
-                "date": legible_date.isoformat()
-            })
+            for row in rows:
+                yield _row_to_record(row)
             
-    except sqlite3.Error as e:
-        print(f"Error from SQLite: {e}")
-        if not DB_FILE.exists():
-            print(f"ERROR: {DB_FILE} NOT FOUND! (Did you copy your Chrome History file?)")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error reading history ({path}): {e}")
+        if not Path(path).exists():
+            print(f"ERROR: {path} NOT FOUND! (Set CHROME_HISTORY_DB or CHROME_USER_DATA_DIR.)")
     
     finally:
         if conn:
             conn.close()
-    
-    return data_for_langchain
+        snapshot_dir.cleanup()
+
+_DONE = object()
+
+def _prefetch(records, size=PREFETCH_ROWS):
+    """Run a profile's query on its own thread, buffering at most `size` records ahead."""
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for record in records:
+                if not put(record):
+                    break
+            put(_DONE)
+        except Exception as e:
+            put(e)
+        finally:
+            records.close()
+
+    threading.Thread(target=produce, daemon=True, name="history-profile").start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def _iter_history(visit_clause, params, history_files=None):
+    """Every profile's stream merged newest first, one record per URL.
+
+    Profiles are queried in parallel; when a URL appears in several, the newest visit is kept.
+    """
+    history_files = HISTORY_FILES if history_files is None else history_files
+    if not history_files:
+        print("ERROR: no Chrome History file found. (Set CHROME_HISTORY_DB or CHROME_USER_DATA_DIR.)")
+        return
+    if len(history_files) == 1:
+        # a single profile is already one row per URL
+        yield from _iter_profile(history_files[0], visit_clause, params)
+        return
+
+    streams = [_prefetch(_iter_profile(path, visit_clause, params)) for path in history_files]
+    seen = set()
+    for record in heapq.merge(*streams, key=lambda r: r["last_visit_time"], reverse=True):
+        if record["url"] in seen:
+            telemetry.count("history.duplicate_urls")
+            continue
+        seen.add(record["url"])
+        yield record
+
+def _date_range_to_chrome(start_date_str, end_date_str):
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
+    return convert_datetime_to_chrome(start_date), convert_datetime_to_chrome(end_date)
+
+def iter_history_data(start_date_str, end_date_str, history_files=None):
+    """Lazy version of get_history_data, one record at a time."""
+    start_chrome_time, end_chrome_time = _date_range_to_chrome(start_date_str, end_date_str)
+    return _iter_history("v.visit_time BETWEEN ? AND ?", (start_chrome_time, end_chrome_time),
+                         history_files)
+
+def iter_history_data_since(after_chrome_time, history_files=None):
+    """Every URL visited after the given Chrome timestamp (incremental runs)."""
+    return _iter_history("v.visit_time > ?", (after_chrome_time,), history_files)
+
+def get_history_data(start_date_str, end_date_str, history_files=None):
+    return list(iter_history_data(start_date_str, end_date_str, history_files))
+
+def get_history_data_since(after_chrome_time, history_files=None):
+    return list(iter_history_data_since(after_chrome_time, history_files))
 
 if __name__ == "__main__":
+    print(f"History files: {', '.join(str(p) for p in HISTORY_FILES) or 'none found'}")
     history_records = get_history_data('2025-09-01', '2025-11-01')
     
     print(f"Length of extracted records: {len(history_records)}")
@@ -0,0 +1,261 @@
+# Concurrent page fetcher (asyncio + aiohttp) used by scraping.py
+
+import os
+import queue
+import asyncio
+import itertools
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import aiohttp
+from langchain_core.documents import Document
+
+try:
+    from src import telemetry  # imported as src.* (agent.py, bench/run.py)
+except ImportError:
+    import telemetry  # run as a script from src/
+
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT_SECONDS", 15))
+MAX_CONCURRENCY = int(os.getenv("FETCH_MAX_CONCURRENCY", 64))  # requests in flight overall
+PER_HOST_LIMIT = int(os.getenv("FETCH_PER_HOST_LIMIT", 4))  # requests in flight per host
+MAX_PAGE_BYTES = int(os.getenv("FETCH_MAX_PAGE_BYTES", 5_000_000))
+PROGRESS_EVERY = 100
+FETCH_BUFFER_SIZE = int(os.getenv("FETCH_BUFFER_SIZE", 256))  # fetched pages waiting for the next stage
+# answers worth asking again later; any other 4xx, non-HTML or oversize page is a permanent outcome
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+RECORD_BATCH = 64  # records pulled from the (lazy, SQLite-backed) record iterator per worker-thread hop
+
+_DONE = object()
+
+# same kind of headers WebBaseLoader sends, so sites answer the way they did before
+DEFAULT_HEADERS = {
+    "User-Agent": os.getenv(
+        "USER_AGENT",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    ),
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+}
+
+
+class FetchStats:
+    """Counters for one fetch run."""
+
+    def __init__(self):
+        self.fetched = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+        self.stored = 0  # served from the page store without a request
+        self.not_modified = 0  # 304 to a conditional request
+
+    def __str__(self):
+        return (f"fetched={self.fetched} failed={self.failed} skipped={self.skipped} bytes={self.bytes} "
+                f"stored={self.stored} not_modified={self.not_modified}")
+
+
+async def _stored_document(store, url, stats, counter):
+    html = await asyncio.to_thread(store.get, url)
+    setattr(stats, counter, getattr(stats, counter) + 1)
+    telemetry.count(f"fetch.{counter}")
+    return Document(page_content=html, metadata={"source": url})
+
+
+async def _fetch_one(session, url, global_sem, host_sems, stats, store=None):
+    """(Document, False), or (None, retryable) when the page could not be had."""
+    # PAGE STORE - fresh copies skip the network, older ones are revalidated with a conditional GET
+    validators = await asyncio.to_thread(store.validators, url) if store is not None else None
+    if validators is not None and store.is_fresh(validators[2]):
+        return await _stored_document(store, url, stats, "stored"), False
+    headers = store.conditional_headers(*validators) if validators is not None else None
+
+    # the per-host slot is taken first so a busy host doesn't hold global slots while it waits
+    host = urlparse(url).netloc
+    async with host_sems[host]:
+        async with global_sem:
+            try:
+                with telemetry.span("fetch.request"):
+                    async with session.get(url, allow_redirects=True, headers=headers) as resp:
+                        if resp.status == 304 and validators is not None:
+                            await asyncio.to_thread(store.touch, url, resp.headers.get("ETag"),
+                                                    resp.headers.get("Last-Modified"))
+                            return await _stored_document(store, url, stats, "not_modified"), False
+
+                        if resp.status >= 400:
+                            stats.failed += 1
+                            telemetry.count("fetch.failed")
+                            return None, resp.status in RETRY_STATUSES or resp.status >= 500
+
+                        content_type = resp.headers.get("Content-Type", "")
+                        if content_type and "html" not in content_type and "text" not in content_type:
+                            stats.skipped += 1  # PDFs, images, downloads...
+                            telemetry.count("fetch.skipped")
+                            return None, False
+
+                        if (resp.content_length or 0) > MAX_PAGE_BYTES:
+                            stats.skipped += 1
+                            telemetry.count("fetch.skipped")
+                            return None, False
+
+                        html = await resp.text(errors="replace")
+                        if store is not None:
+                            await asyncio.to_thread(store.put, url, html, resp.headers.get("ETag"),
+                                                    resp.headers.get("Last-Modified"))
+            except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError, ValueError) as e:
+                # one bad URL never takes the rest of the run down with it
+                stats.failed += 1
+                telemetry.count("fetch.failed")
+                if stats.failed <= 10:
+                    print(f"⚠️ Error loading {url}: {type(e).__name__}: {e}")
+                # network trouble may pass; a URL that cannot be requested or decoded will not
+                return None, isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError,
+                                            aiohttp.ClientPayloadError))
+
+    stats.fetched += 1
+    stats.bytes += len(html)
+    telemetry.count("fetch.pages")
+    telemetry.count("fetch.bytes", len(html))
+    if stats.fetched % PROGRESS_EVERY == 0:
+        print(f"Fetched {stats.fetched} pages ({stats})")
+
+    return Document(page_content=html, metadata={"source": url}), False
+
+
+async def afetch_documents(urls, max_concurrency=MAX_CONCURRENCY, per_host_limit=PER_HOST_LIMIT,
+                           timeout=REQUEST_TIMEOUT, store=None):
+    """Fetch every URL concurrently, returning Documents (raw HTML) in input order.
+
+    Failed or non-HTML pages are dropped instead of failing the whole run. With a
+    page_store.PageStore, pages are read from / written to it (see _fetch_one).
+    """
+    stats = FetchStats()
+    global_sem = asyncio.Semaphore(max_concurrency)
+    host_sems = defaultdict(lambda: asyncio.Semaphore(per_host_limit))
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout,
+                                     headers=DEFAULT_HEADERS) as session:
+        results = await asyncio.gather(*(
+            _fetch_one(session, url, global_sem, host_sems, stats, store) for url in urls
+        ))
+
+    print(f"Fetch finished: {stats}")
+    return [doc for doc, _ in results if doc is not None]
+
+
+def fetch_documents(urls, **kwargs):
+    """Synchronous wrapper around afetch_documents for the ingestion scripts."""
+    return asyncio.run(afetch_documents(urls, **kwargs))
+
+
+# --- STREAMING ---
+async def _produce(records, out, stop, max_concurrency, per_host_limit, timeout, buffer_size, store,
+                   on_failure=None):
+    stats = FetchStats()
+    global_sem = asyncio.Semaphore(max_concurrency)
+    host_sems = defaultdict(lambda: asyncio.Semaphore(per_host_limit))
+    # caps how many URLs are pulled from `records` ahead of the ones being downloaded
+    in_flight = asyncio.Semaphore(max_concurrency * 4)
+    results = asyncio.Queue(maxsize=buffer_size)
+
+    def put_blocking(item):
+        # hand over to the consumer thread, giving up if it went away
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    async def forward():
+        while True:
+            item = await results.get()
+            if item is _DONE:
+                return
+            await asyncio.to_thread(put_blocking, item)
+
+    async def fetch_record(session, record):
+        try:
+            doc, retryable = await _fetch_one(session, record["url"], global_sem, host_sems, stats, store)
+            if doc is not None:
+                await results.put((record, doc))  # waits while the downstream buffer is full
+            elif on_failure is not None:
+                on_failure(record, retryable)
+        finally:
+            in_flight.release()
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency, ttl_dns_cache=300)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    forwarder = asyncio.create_task(forward())
+    tasks = set()
+
+    # `records` may do blocking work per item (scraping.filter_records reads and writes SQLite), so it
+    # is advanced in a worker thread, never on the loop that drives the downloads
+    records = iter(records)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout,
+                                     headers=DEFAULT_HEADERS) as session:
+        while not stop.is_set():
+            batch = await asyncio.to_thread(lambda: list(itertools.islice(records, RECORD_BATCH)))
+            if not batch:
+                break
+            for record in batch:
+                await in_flight.acquire()
+                task = asyncio.create_task(fetch_record(session, record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    await results.put(_DONE)
+    await forwarder
+    print(f"Fetch finished: {stats}")
+
+
+def iter_fetch_documents(records, max_concurrency=MAX_CONCURRENCY, per_host_limit=PER_HOST_LIMIT,
+                         timeout=REQUEST_TIMEOUT, buffer_size=FETCH_BUFFER_SIZE, store=None, on_failure=None):
+    """Stream (record, Document) pairs as pages finish downloading, in completion order.
+
+    Records whose page could not be had are passed to `on_failure(record, retryable)` instead
+    (called on the fetcher's thread); retryable means a timeout, connection error or 5xx/429.
+
+    `records` can be a lazy iterator of history records (dicts with a "url" key); it is
+    consumed only as fast as the caller takes pages, so memory stays bounded by
+    buffer_size plus the requests in flight. The event loop runs on a background thread.
+    """
+    out = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    errors = []
+
+    def run():
+        try:
+            asyncio.run(_produce(records, out, stop, max_concurrency, per_host_limit, timeout,
+                                 buffer_size, store, on_failure))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            out.put(_DONE)
+
+    thread = threading.Thread(target=run, name="page-fetcher", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = out.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+        # unblock the producer's final put if the consumer stopped early
+        while thread.is_alive():
+            try:
+                out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+    if errors:
+        raise errors[0]
@@ -0,0 +1,140 @@
+# Bookkeeping for incremental ingestion: visit-time watermark + per-URL content hashes + pages to retry
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+
+STATE_FILENAME = "ingest_state.sqlite3"
+# incremental runs retry a page that failed to fetch this many times before giving up on it
+MAX_FETCH_ATTEMPTS = int(os.getenv("MAX_FETCH_ATTEMPTS", 3))
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="replace")).hexdigest()
+
+
+def chunk_id(url: str, text: str) -> str:
+    """Stable chunk ID: the same chunk of the same page always maps to the same vector row."""
+    return hashlib.sha1(f"{url}\0{text}".encode("utf-8", errors="replace")).hexdigest()
+
+
+class IngestState:
+    """SQLite file stored next to the vector store it describes."""
+
+    def __init__(self, persist_directory: str):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, STATE_FILENAME)
+        # the streaming pipeline reads from the fetch thread and writes from the main thread
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                chunk_ids TEXT NOT NULL,
+                last_visit_time INTEGER,
+                indexed_at TEXT
+            );
+            -- history records that were behind the watermark when their page failed to fetch
+            CREATE TABLE IF NOT EXISTS failed_pages (
+                url TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 1
+            );
+        """)
+
+    # --- WATERMARK ---
+    def get_watermark(self):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_visit_time'").fetchone()
+        return int(row[0]) if row else None
+
+    def set_watermark(self, chrome_time: int):
+        current = self.get_watermark()
+        if current is not None and chrome_time <= current:
+            return  # never move backwards
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_visit_time', ?)",
+                (str(chrome_time),)
+            )
+            self.conn.commit()
+
+    # --- PAGES ---
+    def get_pages(self, urls):
+        """Return {url: (content_hash, chunk_ids)} for the URLs that were indexed before."""
+        pages = {}
+        urls = list(urls)
+        for i in range(0, len(urls), 500):  # stay under SQLite's bound-parameter limit
+            batch = urls[i:i + 500]
+            placeholders = ",".join("?" * len(batch))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT url, content_hash, chunk_ids FROM pages WHERE url IN ({placeholders})",
+                    batch
+                ).fetchall()
+            for url, page_hash, ids in rows:
+                pages[url] = (page_hash, json.loads(ids))
+        return pages
+
+    def is_committed(self, url, last_visit_time):
+        """True if this visit of the URL was already indexed (lets a crashed run resume)."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_visit_time FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        return bool(row and row[0] is not None and last_visit_time is not None
+                    and row[0] >= last_visit_time)
+
+    def record_page(self, url, page_hash, chunk_ids, last_visit_time=None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages (url, content_hash, chunk_ids, last_visit_time, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, page_hash, json.dumps(chunk_ids), last_visit_time, datetime.now().isoformat())
+            )
+
+    # --- RETRIES ---
+    def failed_records(self):
+        """History records of pages that failed in earlier runs, to be fed to the next incremental run."""
+        with self.lock:
+            rows = self.conn.execute("SELECT record FROM failed_pages").fetchall()
+        return [json.loads(record) for record, in rows]
+
+    def update_failures(self, failed, succeeded, max_attempts=MAX_FETCH_ATTEMPTS):
+        """Count another attempt for each failed record, forget the URLs that went through.
+
+        Returns the URLs given up on after `max_attempts`.
+        """
+        given_up = []
+        with self.lock:
+            self.conn.executemany("DELETE FROM failed_pages WHERE url = ?", [(url,) for url in succeeded])
+            for record in failed:
+                self.conn.execute("""
+                    INSERT INTO failed_pages (url, record) VALUES (?, ?)
+                    ON CONFLICT(url) DO UPDATE SET record = excluded.record, attempts = attempts + 1
+                """, (record['url'], json.dumps(record)))
+                attempts, = self.conn.execute(
+                    "SELECT attempts FROM failed_pages WHERE url = ?", (record['url'],)
+                ).fetchone()
+                if attempts >= max_attempts:
+                    self.conn.execute("DELETE FROM failed_pages WHERE url = ?", (record['url'],))
+                    given_up.append(record['url'])
+            self.conn.commit()
+        return given_up
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
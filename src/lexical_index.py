@@ -0,0 +1,321 @@
+# Local full-text (SQLite FTS5 / BM25) index over the same chunks as the vector store,
+# plus the hybrid retriever that fuses it with vector search
+
+import os
+import re
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+try:
+    from src import telemetry  # imported by agent.py
+except ImportError:
+    import telemetry  # imported by the ingestion scripts in src/
+
+LEXICAL_FILENAME = "lexical.sqlite3"
+RRF_K = 60  # standard reciprocal rank fusion constant
+QUESTION_WORDS = {"what", "when", "where", "which", "who", "why", "how", "did", "do", "does",
+                  "was", "were", "is", "are", "can", "could", "should", "tell", "show", "find"}
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+DAY_SECONDS = 86400
+# "most recent" searches look at these slices (days before the newest visit) before the whole history
+RECENT_WINDOWS_DAYS = (30, 90, 365, None)
+
+TimeRange = Tuple[Optional[int], Optional[int]]  # unix seconds, start inclusive / end exclusive
+
+
+def iso_to_epoch(date: Optional[str]) -> Optional[int]:
+    """ISO dates in chunk metadata are naive UTC (see extract_urls)."""
+    if not date:
+        return None
+    try:
+        return int((datetime.fromisoformat(date) - datetime(1970, 1, 1)).total_seconds())
+    except ValueError:
+        return None
+
+
+def chroma_time_filter(time_range: Optional[TimeRange]) -> Optional[dict]:
+    """Store-side `where` clause on the numeric visit_ts metadata."""
+    if not time_range:
+        return None
+    start, end = time_range
+    conditions = []
+    if start is not None:
+        conditions.append({"visit_ts": {"$gte": start}})
+    if end is not None:
+        conditions.append({"visit_ts": {"$lt": end}})
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def fts_query(query: str, operator: str = "AND") -> str:
+    """Turn free text into a safe FTS5 expression (every token quoted, so no syntax errors)."""
+    tokens = _TOKEN_RE.findall(query.lower())
+    return f" {operator} ".join(f'"{t}"' for t in tokens)
+
+
+def is_lexical_query(query: str) -> bool:
+    """Keyword lookups ("amazon", a product, owner/repo, a domain) that BM25 answers well on its own."""
+    stripped = query.strip()
+    if not stripped:
+        return False
+    if stripped.startswith('"') and stripped.endswith('"'):
+        return True
+    if re.search(r"\b[\w-]+\.(com|org|net|io|dev|ai|co|edu|gov)\b", stripped, re.I):
+        return True
+    if re.fullmatch(r"[\w.-]+/[\w.-]+", stripped):
+        return True
+    tokens = _TOKEN_RE.findall(stripped.lower())
+    return 0 < len(tokens) <= 3 and not QUESTION_WORDS.intersection(tokens)
+
+
+class LexicalIndex:
+    """FTS5 table stored next to the vector store, keyed by the same chunk IDs."""
+
+    def __init__(self, persist_directory: str):
+        os.makedirs(persist_directory, exist_ok=True)
+        self.path = os.path.join(persist_directory, LEXICAL_FILENAME)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunk_rows (
+                rowid INTEGER PRIMARY KEY,
+                chunk_id TEXT UNIQUE NOT NULL,
+                source TEXT,
+                title TEXT,
+                date TEXT,
+                visit_ts INTEGER,
+                content TEXT
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                title, content,
+                content='chunk_rows', content_rowid='rowid',
+                tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunk_rows_ai AFTER INSERT ON chunk_rows BEGIN
+                INSERT INTO chunks_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunk_rows_ad AFTER DELETE ON chunk_rows BEGIN
+                INSERT INTO chunks_fts(chunks_fts, rowid, title, content)
+                VALUES ('delete', old.rowid, old.title, old.content);
+            END;
+        """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(chunk_rows)")]
+        if "visit_ts" not in columns:  # index files created before dates were numeric
+            self.conn.execute("ALTER TABLE chunk_rows ADD COLUMN visit_ts INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_chunk_rows_visit_ts ON chunk_rows (visit_ts)")
+        self.conn.commit()
+
+    # --- WRITES ---
+    def upsert(self, ids: List[str], documents: List[Document]):
+        with self.lock:
+            self._delete(ids)
+            self.conn.executemany(
+                "INSERT INTO chunk_rows (chunk_id, source, title, date, visit_ts, content) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(chunk_id, doc.metadata.get('source'), doc.metadata.get('title'), doc.metadata.get('date'),
+                  doc.metadata.get('visit_ts', iso_to_epoch(doc.metadata.get('date'))), doc.page_content)
+                 for chunk_id, doc in zip(ids, documents)]
+            )
+            self.conn.commit()
+
+    def delete(self, ids: List[str]):
+        with self.lock:
+            self._delete(ids)
+            self.conn.commit()
+
+    def _delete(self, ids):
+        ids = list(ids)
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            self.conn.execute(
+                f"DELETE FROM chunk_rows WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+            )
+
+    # --- READS ---
+    def search(self, query: str, k: int = 8, time_range: Optional[TimeRange] = None) -> List[Document]:
+        """BM25-ranked chunks; all terms first, any term if that finds nothing."""
+        conditions, params = ["chunks_fts MATCH ?"], []
+        if time_range and time_range[0] is not None:
+            conditions.append("r.visit_ts >= ?")
+            params.append(time_range[0])
+        if time_range and time_range[1] is not None:
+            conditions.append("r.visit_ts < ?")
+            params.append(time_range[1])
+
+        for operator in ("AND", "OR"):
+            expression = fts_query(query, operator)
+            if not expression:
+                return []
+            with self.lock, telemetry.span("retrieval.bm25"):
+                rows = self.conn.execute(f"""
+                    SELECT r.chunk_id, r.source, r.title, r.date, r.visit_ts, r.content,
+                           bm25(chunks_fts, 2.0, 1.0) AS score
+                    FROM chunks_fts JOIN chunk_rows r ON r.rowid = chunks_fts.rowid
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY score
+                    LIMIT ?
+                """, (expression, *params, k)).fetchall()
+            if rows:
+                return [
+                    Document(id=chunk_id, page_content=content,
+                             metadata={'source': source, 'title': title, 'date': date,
+                                       'visit_ts': visit_ts, 'bm25': -score})
+                    for chunk_id, source, title, date, visit_ts, content, score in rows
+                ]
+        return []
+
+    def get_documents(self, ids: List[str]) -> List[Document]:
+        """Chunks by ID, in the order given (unknown IDs are skipped); used by the memmap store."""
+        rows = {}
+        ids = list(ids)
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                for chunk_id, source, title, date, visit_ts, content in self.conn.execute(f"""
+                    SELECT chunk_id, source, title, date, visit_ts, content FROM chunk_rows
+                    WHERE chunk_id IN ({','.join('?' * len(batch))})
+                """, batch):
+                    rows[chunk_id] = Document(id=chunk_id, page_content=content,
+                                              metadata={'source': source, 'title': title, 'date': date,
+                                                        'visit_ts': visit_ts})
+        return [rows[chunk_id] for chunk_id in ids if chunk_id in rows]
+
+    def latest_visit_ts(self) -> Optional[int]:
+        with self.lock:
+            return self.conn.execute("SELECT MAX(visit_ts) FROM chunk_rows").fetchone()[0]
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM chunk_rows").fetchone()[0]
+
+    def rebuild_from_chroma(self, vector_store, batch_size: int = 1000):
+        """Backfill the index from an existing Chroma collection (stores indexed before FTS existed)."""
+        collection = vector_store._collection
+        offset = 0
+        while True:
+            batch = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            documents = [Document(page_content=text or "", metadata=meta or {})
+                         for text, meta in zip(batch["documents"], batch["metadatas"])]
+            self.upsert(batch["ids"], documents)
+            offset += len(batch["ids"])
+        print(f"Lexical index rebuilt with {self.count()} chunks.")
+
+
+# --- HYBRID RETRIEVAL ---
+def _doc_key(doc) -> str:
+    if getattr(doc, "id", None):
+        return doc.id
+    return hashlib.sha1(f"{doc.metadata.get('source')}\0{doc.page_content}".encode()).hexdigest()
+
+
+def reciprocal_rank_fusion(result_lists, k: int, rrf_k: int = RRF_K) -> List[Any]:
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked[:k]]
+
+
+class HybridRetriever:
+    """BM25 + vector search fused with reciprocal rank fusion.
+
+    Keyword-style queries that the lexical index can answer skip the embedding call entirely.
+    """
+
+    def __init__(self, vector_retriever, lexical_index: LexicalIndex, k: int = 8):
+        self.vector_retriever = vector_retriever
+        self.lexical_index = lexical_index
+        self.k = k
+        self.counters = {"lexical_fast_path": 0, "fused": 0, "recent_searches": 0}
+
+    def _lexical_fast_path(self, query, lexical, k):
+        # FAST PATH - purely lexical query with enough exact hits, no embedding round-trip
+        if lexical and is_lexical_query(query) and len(lexical) >= min(k, 3):
+            self.counters["lexical_fast_path"] += 1
+            return lexical[:k]
+        return None
+
+    def _fuse(self, vector, lexical, k):
+        if not lexical:
+            return vector
+        self.counters["fused"] += 1
+        return reciprocal_rank_fusion([vector, lexical], k=k)
+
+    def invoke(self, query: str, k: Optional[int] = None,
+               time_range: Optional[TimeRange] = None) -> List[Any]:
+        k = k or self.k
+        lexical = self.lexical_index.search(query, k=k * 2, time_range=time_range)
+        fast = self._lexical_fast_path(query, lexical, k)
+        if fast is not None:
+            return fast
+
+        # the date range is pushed down to the store as a `where` filter
+        vector = self.vector_retriever.invoke(query, k=k, filter=chroma_time_filter(time_range))
+        return self._fuse(vector, lexical, k)
+
+    async def ainvoke(self, query: str, k: Optional[int] = None,
+                      time_range: Optional[TimeRange] = None) -> List[Any]:
+        k = k or self.k
+        lexical = await asyncio.to_thread(self.lexical_index.search, query, k * 2, time_range)
+        fast = self._lexical_fast_path(query, lexical, k)
+        if fast is not None:
+            return fast
+
+        vector = await self.vector_retriever.ainvoke(query, k=k, filter=chroma_time_filter(time_range))
+        return self._fuse(vector, lexical, k)
+
+    def _recent_windows(self, time_range: Optional[TimeRange]):
+        """Windows are anchored on the newest indexed visit rather than today, so an index built
+        months ago still has a "recent" slice."""
+        start, end = time_range or (None, None)
+        anchor = end or self.lexical_index.latest_visit_ts()
+        for days in RECENT_WINDOWS_DAYS if anchor else (None,):
+            window_start = anchor - days * DAY_SECONDS if days else None
+            if start is not None:
+                window_start = max(start, window_start) if window_start is not None else start
+            yield (window_start, end), window_start == start
+
+    def _newest_first(self, docs):
+        self.counters["recent_searches"] += 1
+        return sorted(docs, key=lambda d: d.metadata.get('visit_ts') or iso_to_epoch(d.metadata.get('date')) or 0,
+                      reverse=True)
+
+    def invoke_recent(self, query: str, k: Optional[int] = None,
+                      time_range: Optional[TimeRange] = None) -> List[Any]:
+        """Newest relevant chunks first, searching small recent slices before the whole history."""
+        k = k or self.k
+        docs = []
+        for window, is_last in self._recent_windows(time_range):
+            docs = self.invoke(query, k=k, time_range=window)
+            if len(docs) >= k or is_last:
+                break
+        return self._newest_first(docs)
+
+    async def ainvoke_recent(self, query: str, k: Optional[int] = None,
+                             time_range: Optional[TimeRange] = None) -> List[Any]:
+        k = k or self.k
+        docs = []
+        for window, is_last in self._recent_windows(time_range):
+            docs = await self.ainvoke(query, k=k, time_range=window)
+            if len(docs) >= k or is_last:
+                break
+        return self._newest_first(docs)
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        if hasattr(self.vector_retriever, "stats"):
+            stats.update(self.vector_retriever.stats())
+        return stats
+
@@ -0,0 +1,141 @@
+# On-disk store of raw fetched HTML keyed by (canonical) URL, with the validators needed for
+# conditional requests. Re-ingesting with other chunking/html2text settings reads pages from here
+# instead of the network (scraping.py --from-store).
+
+import os
+import gzip
+import time
+import sqlite3
+import threading
+from email.utils import formatdate
+
+from langchain_core.documents import Document
+
+try:
+    from src import telemetry  # imported as src.* (agent.py, bench/run.py)
+except ImportError:
+    import telemetry  # run as a script from src/
+
+try:
+    import zstandard
+except ImportError:  # optional, pages are gzipped without it
+    zstandard = None
+
+PAGE_STORE_PATH = os.getenv("PAGE_STORE_PATH", "./data/page_store.sqlite3")
+# stored pages younger than this are used without asking the server at all
+PAGE_MAX_AGE_HOURS = float(os.getenv("PAGE_MAX_AGE_HOURS", 24 * 7))
+ZSTD_LEVEL = 10
+
+
+def _compress(data: bytes):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=6)
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("page store entry is zstd-compressed but `zstandard` is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+
+class PageStore:
+    """SQLite table of compressed pages: url -> (html, ETag, Last-Modified, fetch time)."""
+
+    def __init__(self, path: str = PAGE_STORE_PATH, max_age_hours: float = PAGE_MAX_AGE_HOURS):
+        self.max_age = max_age_hours * 3600
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # written from the fetcher's event-loop thread, read from wherever iter_documents runs
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                codec TEXT NOT NULL,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def validators(self, url: str):
+        """(etag, last_modified, fetched_at) of the stored copy, or None; the body is not read."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT etag, last_modified, fetched_at FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+
+    def get(self, url: str):
+        """Stored HTML, or None."""
+        with self.lock:
+            row = self.conn.execute("SELECT codec, body FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        with telemetry.span("page_store.read"):
+            return _decompress(*row).decode("utf-8", errors="replace")
+
+    def is_fresh(self, fetched_at: float) -> bool:
+        return time.time() - fetched_at < self.max_age
+
+    def conditional_headers(self, etag, last_modified, fetched_at) -> dict:
+        """If-None-Match / If-Modified-Since for revalidating a stored page."""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        # without a Last-Modified, our own fetch time is the next best date
+        headers["If-Modified-Since"] = last_modified or formatdate(fetched_at, usegmt=True)
+        return headers
+
+    def put(self, url: str, html: str, etag=None, last_modified=None):
+        with telemetry.span("page_store.write"):
+            codec, blob = _compress(html.encode("utf-8", errors="replace"))
+        with self.lock:
+            self.conn.execute("""
+                INSERT INTO pages (url, codec, body, etag, last_modified, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(url) DO UPDATE SET
+                    codec = excluded.codec, body = excluded.body, etag = excluded.etag,
+                    last_modified = excluded.last_modified, fetched_at = excluded.fetched_at
+            """, (url, codec, blob, etag, last_modified, time.time()))
+            self.conn.commit()
+        telemetry.count("page_store.bytes_written", len(blob))
+
+    def touch(self, url: str, etag=None, last_modified=None):
+        """The server answered 304: the stored copy is current as of now."""
+        with self.lock:
+            self.conn.execute("""
+                UPDATE pages SET fetched_at = ?, etag = COALESCE(?, etag),
+                                 last_modified = COALESCE(?, last_modified)
+                WHERE url = ?
+            """, (time.time(), etag, last_modified, url))
+            self.conn.commit()
+
+    def iter_documents(self, records):
+        """Offline replacement for fetcher.iter_fetch_documents: (record, Document) for every
+        record whose page is stored, with no network access at all."""
+        missing = 0
+        for record in records:
+            html = self.get(record["url"])
+            if html is None:
+                missing += 1
+                telemetry.count("page_store.missing")
+                continue
+            telemetry.count("page_store.pages")
+            yield record, Document(page_content=html, metadata={"source": record["url"]})
+        if missing:
+            print(f"⚠️ {missing} pages are not in the page store and were skipped (fetch them without --from-store).")
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -1,80 +1,237 @@
+# Builds data/user_profile.txt (injected into the agent's system prompt) from the whole corpus:
+#   MAP    - mini-batch k-means over every stored chunk vector, a few representative chunks per
+#            cluster, one summary per cluster (parallel batched LLM calls)
+#   REDUCE - one LLM call that turns the cluster summaries, weighted by size, into the profile
+# Centroids and summaries are kept in PROFILE_DIRECTORY; the next run starts from those centroids
+# and only re-summarises clusters whose representative chunks changed.
+#
+#   python src/profile_gen.py               # incremental refresh
+#   python src/profile_gen.py --full        # re-summarise every cluster
+
 import os
+import json
+import argparse
 import numpy as np
 np.float_ = np.float64
 from dotenv import load_dotenv
 from langchain_chroma import Chroma
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_openai import ChatOpenAI
 # from langchain.chat_models import init_chat_model
 
+try:
+    from src import telemetry  # imported as src.* (agent.py, bench/run.py)
+    from src.vector_store_mmap import MmapVectorStore, build_from_chroma, mmap_dtype
+except ImportError:
+    import telemetry  # run as a script from src/
+    from vector_store_mmap import MmapVectorStore, build_from_chroma, mmap_dtype
+
 load_dotenv()
 
 PERSIST_DIRECTORY = "./data/chroma_db"
-COLLECTION_NAME = "user-history-data" 
+COLLECTION_NAME = "user-history-data"
+PROFILE_FILENAME = "data/user_profile.txt"
+PROFILE_DIRECTORY = "./data/profile"  # centroids, cluster summaries and (if needed) a vector snapshot
+
+PROFILE_CLUSTERS = int(os.getenv("PROFILE_CLUSTERS", 24))
+REPRESENTATIVES = int(os.getenv("PROFILE_REPRESENTATIVES", 6))  # chunks shown to the LLM per cluster
+REPRESENTATIVE_CHARS = 800  # each representative is cut to this, bounding every map prompt
+KMEANS_BATCH_SIZE = 2048
+KMEANS_ITERATIONS = int(os.getenv("PROFILE_KMEANS_ITERATIONS", 100))
+ASSIGN_BLOCK_ROWS = 16384
+LLM_CONCURRENCY = int(os.getenv("PROFILE_LLM_CONCURRENCY", 8))
+REUSE_OVERLAP = 0.5  # share of a cluster's representatives that must be unchanged to keep its summary
 
 # ChatOpenAI for the LLM, lets keep it as less creative as possible
 llm = ChatOpenAI(model="gpt-4o", temperature=0)
 
-# INITIALIZE EMBEDDINGS AND VECTOR STORE
-embeddings = OpenAIEmbeddings() 
 
-vector_store = Chroma(
-    collection_name=COLLECTION_NAME,
-    embedding_function=embeddings,
-    persist_directory=PERSIST_DIRECTORY
-)
+# --- VECTORS ---
+def _dequantize(store: MmapVectorStore, rows) -> np.ndarray:
+    return store.vectors[rows].astype(np.float32) * store.scales[rows][:, None]
 
-# RETRIEVER OF DATA
-retriever = vector_store.as_retriever(
-    search_type="similarity",
-    search_kwargs={"k": 8}
-)
+def open_vectors(vector_store, persist_directory=PERSIST_DIRECTORY, profile_directory=PROFILE_DIRECTORY):
+    """Unit vectors of every chunk as a memmap.
 
-# HELPER FUNCTION - include the title in the context
-def format_docs(docs):
-    formatted_content = []
-    for doc in docs:
-        title = doc.metadata.get('title', 'No Title Available')
-        content = doc.page_content
-        formatted_content.append(f"--- DOCUMENT TITLE: {title} ---\n{content}")
-        
-    return "\n\n".join(formatted_content)
+    The agent's memmap index is used when the store has one (scraping.py keeps it current);
+    otherwise the collection is exported into the profile directory, one batch at a time.
+    """
+    if not mmap_dtype(persist_directory):
+        build_from_chroma(vector_store, profile_directory, dtype="int8")
+        persist_directory = profile_directory
+    # chunk text comes from Chroma, see representative_documents
+    return MmapVectorStore(persist_directory, document_lookup=None)
+
+
+# --- MAP: CLUSTERING ---
+def _kmeans_plus_plus(sample: np.ndarray, k: int, rng) -> np.ndarray:
+    centers = [sample[rng.integers(len(sample))]]
+    closest = 1 - sample @ centers[0]
+    for _ in range(1, k):
+        probabilities = np.clip(closest, 0, None)
+        probabilities = probabilities / probabilities.sum() if probabilities.sum() else None
+        centers.append(sample[rng.choice(len(sample), p=probabilities)])
+        closest = np.minimum(closest, 1 - sample @ centers[-1])
+    return np.stack(centers)
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
 
+def minibatch_kmeans(store: MmapVectorStore, k: int, init=None, iterations=KMEANS_ITERATIONS,
+                     batch_size=KMEANS_BATCH_SIZE, seed=0):
+    """Spherical mini-batch k-means (cosine); cost is iterations x batch_size, not the corpus size.
+
+    `init` is last run's (centers, counts). Starting from them, with their learning rates already
+    decayed, keeps clusters where they were unless the data moved, so unchanged topics keep their
+    summaries. Returns (centers, counts).
+    """
+    rng = np.random.default_rng(seed)
+    total = len(store)
+    if init is not None and init[0].shape == (k, store.vectors.shape[1]):
+        centers, counts = init[0].astype(np.float32), init[1].astype(np.float64)
+    else:
+        sample = _dequantize(store, np.sort(rng.choice(total, size=min(total, 20 * k), replace=False)))
+        centers, counts = _kmeans_plus_plus(sample, k, rng), np.zeros(k)
+
+    for _ in range(iterations):
+        rows = np.sort(rng.choice(total, size=min(total, batch_size), replace=False))
+        batch = _dequantize(store, rows)
+        labels = np.argmax(batch @ centers.T, axis=1)
+        for cluster in np.unique(labels):
+            members = batch[labels == cluster]
+            counts[cluster] += len(members)
+            rate = len(members) / counts[cluster]  # per-center learning rate, decays as it settles
+            centers[cluster] = (1 - rate) * centers[cluster] + rate * members.mean(axis=0)
+        centers = _normalize(centers)
+    return centers, counts
+
+def assign(store: MmapVectorStore, centers: np.ndarray):
+    """Cluster label and cosine similarity to it for every row, one block at a time."""
+    labels = np.empty(len(store), dtype=np.int32)
+    similarity = np.empty(len(store), dtype=np.float32)
+    for start in range(0, len(store), ASSIGN_BLOCK_ROWS):
+        rows = np.arange(start, min(start + ASSIGN_BLOCK_ROWS, len(store)))
+        scores = _dequantize(store, rows) @ centers.T
+        labels[rows] = np.argmax(scores, axis=1)
+        similarity[rows] = scores[np.arange(len(rows)), labels[rows]]
+    return labels, similarity
+
+def representatives(store: MmapVectorStore, labels, similarity, k: int, per_cluster=REPRESENTATIVES):
+    """Per cluster: its size and the chunk IDs closest to its centroid, one per domain first."""
+    order = np.lexsort((-similarity, labels))  # by cluster, best match first
+    bounds = np.searchsorted(labels[order], np.arange(k + 1))
+    clusters = []
+    for cluster in range(k):
+        members = order[bounds[cluster]:bounds[cluster + 1]]
+        picked, domains = [], set()
+        for row in members:
+            if store.domain_ids[row] not in domains:
+                picked.append(row)
+                domains.add(store.domain_ids[row])
+                if len(picked) == per_cluster:
+                    break
+        for row in members:
+            if len(picked) >= per_cluster:
+                break
+            if row not in picked:
+                picked.append(row)
+        clusters.append({"size": int(len(members)), "representatives": [store.ids[row] for row in picked]})
+    return clusters
+
+
+# --- MAP: SUMMARIES ---
 # SYSTEM PROMPT
 llm_template = """
 ## TASK
 You are a helpful assistant analyzing user browsing history.
-Use the following pieces of retrieved website content to answer the question.
+The pages below are the most typical of one group of pages the user visited.
+Describe in 2-3 sentences what this group says about the user's interests or activities.
 ## RULES
 - If the content looks like navigation menus or footers, ignore it.
 - If it is a job search website do not give specific information like names and company.
 - Be general in what you find and do not give details that could be too personal, just personal enough
-for others to see. 
-- If you don't know the answer, just say you don't know.
-- Do not hallucinate, always answer based on the context you retrieve for the user's question.
+for others to see.
+- Do not hallucinate, only describe what the pages show.
 ## INTERACTION FORMAT
-Context:
+Pages:
 {context}
 
-Question:
-{question}
-
-Answer:
+Summary:
 """
 prompt = ChatPromptTemplate.from_template(llm_template)
+summary_chain = prompt | llm | StrOutputParser()
+
+reduce_template = """
+## TASK
+You are a helpful assistant writing a short profile of a user from their browsing history.
+Each theme below summarises a group of pages they visited, with its share of everything they read.
+Write a profile of their primary interests in one or two paragraphs, most important themes first.
+## RULES
+- Be general in what you find and do not give details that could be too personal, just personal enough
+for others to see.
+- Do not hallucinate, only use the themes below.
+## THEMES
+{themes}
+
+Profile:
+"""
+reduce_chain = ChatPromptTemplate.from_template(reduce_template) | llm | StrOutputParser()
+
+# HELPER FUNCTION - include the title in the context
+def format_docs(docs):
+    formatted_content = []
+    for doc in docs:
+        title = doc.metadata.get('title', 'No Title Available')
+        content = doc.page_content[:REPRESENTATIVE_CHARS]
+        formatted_content.append(f"--- DOCUMENT TITLE: {title} ---\n{content}")
+
+    return "\n\n".join(formatted_content)
+
+def representative_documents(vector_store, ids):
+    from langchain_core.documents import Document
+
+    found = vector_store._collection.get(ids=ids, include=["documents", "metadatas"])
+    by_id = {i: Document(page_content=text or "", metadata=meta or {})
+             for i, text, meta in zip(found["ids"], found["documents"], found["metadatas"])}
+    return [by_id[i] for i in ids if i in by_id]
+
+def summarize_clusters(vector_store, clusters):
+    """One summary per cluster; the calls run in parallel, LLM_CONCURRENCY at a time."""
+    contexts = [format_docs(representative_documents(vector_store, c["representatives"])) for c in clusters]
+    with telemetry.span("profile.summarize"):
+        return summary_chain.batch([{"context": context} for context in contexts],
+                                   config={"max_concurrency": LLM_CONCURRENCY})
 
-# BUILD THE RAG CHAIN
-# Retriever -> Format Data -> Fill Prompt -> Send to LLM -> Read Output
-rag_chain = (
-    {"context": retriever | format_docs, "question": RunnablePassthrough()}
-    | prompt
-    | llm
-    | StrOutputParser()
-)
 
-def save_profile(profile_text: str, filename: str = "data/user_profile.txt"):
+# --- REDUCE ---
+def reduce_profile(clusters) -> str:
+    total = sum(c["size"] for c in clusters) or 1
+    themes = "\n".join(f"- ({c['size'] / total:.0%}) {c['summary']}"
+                       for c in sorted(clusters, key=lambda c: c["size"], reverse=True) if c["size"])
+    with telemetry.span("profile.reduce"):
+        return reduce_chain.invoke({"themes": themes})
+
+
+# --- STATE ---
+def load_state(profile_directory=PROFILE_DIRECTORY):
+    """((centers, counts), clusters) of the last run, or (None, [])."""
+    try:
+        with np.load(os.path.join(profile_directory, "centroids.npz")) as saved:
+            kmeans = saved["centers"], saved["counts"]
+        with open(os.path.join(profile_directory, "clusters.json"), encoding="utf-8") as f:
+            return kmeans, json.load(f)
+    except (OSError, ValueError, KeyError):
+        return None, []
+
+def save_state(kmeans, clusters, profile_directory=PROFILE_DIRECTORY):
+    os.makedirs(profile_directory, exist_ok=True)
+    np.savez(os.path.join(profile_directory, "centroids.npz"), centers=kmeans[0], counts=kmeans[1])
+    with open(os.path.join(profile_directory, "clusters.json"), "w", encoding="utf-8") as f:
+        json.dump(clusters, f, indent=2)
+
+def save_profile(profile_text: str, filename: str = PROFILE_FILENAME):
     try:
         os.makedirs(os.path.dirname(filename), exist_ok=True)
         with open(filename, "w", encoding="utf-8") as f:
@@ -84,16 +241,63 @@ def save_profile(profile_text: str, filename: str = "data/user_profile.txt"):
         print(f"\nError saving the profile: {e}")
 
 
+def build_profile(persist_directory=PERSIST_DIRECTORY, k=PROFILE_CLUSTERS, full=False,
+                  profile_directory=PROFILE_DIRECTORY):
+    """Map-reduce the whole collection into a profile; returns None when nothing changed."""
+    vector_store = Chroma(collection_name=COLLECTION_NAME, embedding_function=None,
+                          persist_directory=persist_directory)
+    store = open_vectors(vector_store, persist_directory, profile_directory)
+    if not len(store):
+        print("No indexed chunks to build a profile from.")
+        return None
+    k = min(k, len(store))
+
+    previous_kmeans, previous = load_state(profile_directory)
+    if full:
+        previous_kmeans, previous = None, []
+    with telemetry.span("profile.kmeans"):
+        kmeans = minibatch_kmeans(store, k, init=previous_kmeans)
+        labels, similarity = assign(store, kmeans[0])
+    clusters = representatives(store, labels, similarity, k)
+
+    # INCREMENTAL - a cluster that still has most of last run's representatives keeps its summary
+    changed = []
+    for i, cluster in enumerate(clusters):
+        old = previous[i] if i < len(previous) else {}
+        kept = set(cluster["representatives"]) & set(old.get("representatives", ()))
+        if old.get("summary") and len(kept) >= REUSE_OVERLAP * len(cluster["representatives"]):
+            cluster["summary"] = old["summary"]
+        else:
+            cluster["summary"] = None
+            changed.append(cluster)
+    print(f"{len(store)} chunks in {k} clusters; {len(changed)} to summarise, "
+          f"{k - len(changed)} unchanged.")
+
+    if not changed and os.path.exists(PROFILE_FILENAME):
+        save_state(kmeans, clusters, profile_directory)
+        print("Profile is up to date.")
+        return None
+
+    for cluster, summary in zip(changed, summarize_clusters(vector_store, changed)):
+        cluster["summary"] = summary
+    profile = reduce_profile(clusters)
+    save_state(kmeans, clusters, profile_directory)
+    return profile
+
+
 if __name__ == "__main__":
-    # question = "What specific destinations did the user search?"
-    question = "Summarize the user's primary interests based on all available browsing history."
-    print(f"Question: {question}\n")
-    
-    # Run the chain
-    response = rag_chain.invoke(question)
-    
-    print("Answer:")
-    print(response)
-    
-    # extra step to save basic profile info that will be injected to the agent
-    # save_profile(response)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the user profile from the whole indexed history.")
+    parser.add_argument("--persist-directory", default=PERSIST_DIRECTORY)
+    parser.add_argument("--clusters", type=int, default=PROFILE_CLUSTERS,
+                        help="topics the history is split into (one LLM call each, plus one to combine)")
+    parser.add_argument("--full", action="store_true",
+                        help="recluster from scratch and re-summarise every cluster")
+    args = parser.parse_args()
+
+    profile = build_profile(args.persist_directory, k=args.clusters, full=args.full)
+    if profile:
+        print("Profile:")
+        print(profile)
+        # extra step to save basic profile info that will be injected to the agent
+        save_profile(profile)
+    telemetry.print_summary()
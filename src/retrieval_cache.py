@@ -0,0 +1,177 @@
+# Retrieval cache shared by the agent tools: query embeddings + top-k results
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import numpy as np
+
+try:
+    from src import telemetry  # imported by agent.py
+except ImportError:
+    import telemetry  # imported by the ingestion scripts in src/
+
+MAX_CACHED_QUERIES = int(os.getenv("RETRIEVAL_CACHE_QUERIES", 1024))
+MAX_CACHED_RESULTS = int(os.getenv("RETRIEVAL_CACHE_RESULTS", 512))
+RESULT_TTL_SECONDS = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", 600))
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())
+
+
+def chroma_version(persist_directory: str):
+    """Changes whenever the Chroma collection on disk is written to."""
+    path = os.path.join(persist_directory, "chroma.sqlite3")
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+
+class _LRU:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def get(self, key):
+        if key not in self.items:
+            return None
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+
+class CachedRetriever:
+    """Drop-in for `vector_store.as_retriever()` that remembers work across tool calls.
+
+    - query embeddings are kept in an LRU keyed by normalised query text
+    - top-k results are kept in an LRU with a TTL keyed by (embedding, k, filter)
+    - results are dropped as soon as `version_fn()` reports that the collection changed
+    """
+
+    def __init__(self, vector_store, embeddings, k: int = 8, version_fn=None,
+                 max_queries: int = MAX_CACHED_QUERIES, max_results: int = MAX_CACHED_RESULTS,
+                 ttl_seconds: int = RESULT_TTL_SECONDS):
+        self.vector_store = vector_store
+        self.embeddings = embeddings
+        self.k = k
+        self.version_fn = version_fn
+        self.ttl_seconds = ttl_seconds
+        self._embeddings = _LRU(max_queries)
+        self._results = _LRU(max_results)
+        self._version = version_fn() if version_fn else None
+        self._lock = threading.Lock()
+        self.counters = {"embedding_hits": 0, "embedding_misses": 0,
+                         "result_hits": 0, "result_misses": 0, "invalidations": 0}
+
+    # --- CACHE LAYERS ---
+    def _cached_embedding(self, key: str):
+        with self._lock:
+            embedding = self._embeddings.get(key)
+        self.counters["embedding_hits" if embedding is not None else "embedding_misses"] += 1
+        telemetry.count("retrieval.embedding_hits" if embedding is not None else "retrieval.embedding_misses")
+        return embedding
+
+    def _remember_embedding(self, key: str, embedding):
+        with self._lock:
+            self._embeddings.put(key, embedding)
+        return embedding
+
+    def embed_query(self, query: str) -> List[float]:
+        key = normalize_query(query)
+        embedding = self._cached_embedding(key)
+        if embedding is not None:
+            return embedding
+        with telemetry.span("retrieval.embed_query"):
+            return self._remember_embedding(key, self.embeddings.embed_query(key))
+
+    async def aembed_query(self, query: str) -> List[float]:
+        key = normalize_query(query)
+        embedding = self._cached_embedding(key)
+        if embedding is not None:
+            return embedding
+        with telemetry.span("retrieval.embed_query"):
+            return self._remember_embedding(key, await self.embeddings.aembed_query(key))
+
+    def _check_version(self):
+        if not self.version_fn:
+            return
+        version = self.version_fn()
+        if version != self._version:
+            self.invalidate()
+            self._version = version
+
+    def invalidate(self):
+        """Forget cached results (embeddings stay valid, they don't depend on the collection)."""
+        with self._lock:
+            self._results.clear()
+        self.counters["invalidations"] += 1
+
+    @staticmethod
+    def _result_key(embedding, k, filter):
+        digest = hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+        return (digest, k, json.dumps(filter, sort_keys=True, default=str) if filter else None)
+
+    def _cached_results(self, key):
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.ttl_seconds:
+            self.counters["result_hits"] += 1
+            telemetry.count("retrieval.result_hits")
+            return list(cached[1])
+        self.counters["result_misses"] += 1
+        telemetry.count("retrieval.result_misses")
+        return None
+
+    def _remember_results(self, key, docs):
+        with self._lock:
+            self._results.put(key, (time.monotonic(), docs))
+        return list(docs)
+
+    # --- RETRIEVER INTERFACE ---
+    def invoke(self, query: str, k: Optional[int] = None, filter: Optional[dict] = None) -> List[Any]:
+        k = k or self.k
+        self._check_version()
+        embedding = self.embed_query(query)
+        key = self._result_key(embedding, k, filter)
+
+        cached = self._cached_results(key)
+        if cached is not None:
+            return cached
+        with telemetry.span("retrieval.vector_search"):
+            docs = self.vector_store.similarity_search_by_vector(embedding, k=k, filter=filter)
+        return self._remember_results(key, docs)
+
+    async def ainvoke(self, query: str, k: Optional[int] = None, filter: Optional[dict] = None) -> List[Any]:
+        k = k or self.k
+        self._check_version()
+        embedding = await self.aembed_query(query)
+        key = self._result_key(embedding, k, filter)
+
+        cached = self._cached_results(key)
+        if cached is not None:
+            return cached
+        with telemetry.span("retrieval.vector_search"):
+            docs = await self.vector_store.asimilarity_search_by_vector(embedding, k=k, filter=filter)
+        return self._remember_results(key, docs)
+
+    def stats(self) -> dict:
+        stats = dict(self.counters)
+        for layer in ("embedding", "result"):
+            total = stats[f"{layer}_hits"] + stats[f"{layer}_misses"]
+            stats[f"{layer}_hit_rate"] = stats[f"{layer}_hits"] / total if total else 0.0
+        return stats
@@ -1,109 +1,303 @@
 import os
-import requests
+import argparse
+import itertools
 from dotenv import load_dotenv
-from langchain_community.document_loaders import WebBaseLoader 
-from langchain_community.document_transformers import Html2TextTransformer
-from langchain_openai import OpenAIEmbeddings
 from langchain_chroma import Chroma
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from extract_urls import get_history_data
+try:
+    # one import path per process: src.* when imported as part of the package (bench/run.py)
+    from src.extract_urls import iter_history_data, iter_history_data_since
+    from src.ingest_state import IngestState, chunk_id, MAX_FETCH_ATTEMPTS
+    from src.embedding_cache import CachedEmbeddings
+    from src.embeddings import (get_embedding_backend, backend_metadata, check_collection, stamp_collection,
+                                EMBEDDING_BACKEND)
+    from src.lexical_index import LexicalIndex
+    from src.domain_index import DomainIndex
+    from src.dedup import Deduplicator, canonical_url, SUPPRESSED_PAGE_HASH
+    from src.fetcher import iter_fetch_documents, MAX_CONCURRENCY, PER_HOST_LIMIT
+    from src.page_store import PageStore, PAGE_MAX_AGE_HOURS
+    from src.transform import iter_transform_pages, TRANSFORM_WORKERS
+    from src.vector_store_mmap import build_from_chroma, mmap_dtype
+    from src import telemetry
+except ImportError:
+    # `python src/scraping.py`
+    from extract_urls import iter_history_data, iter_history_data_since
+    from ingest_state import IngestState, chunk_id, MAX_FETCH_ATTEMPTS
+    from embedding_cache import CachedEmbeddings
+    from embeddings import (get_embedding_backend, backend_metadata, check_collection, stamp_collection,
+                            EMBEDDING_BACKEND)
+    from lexical_index import LexicalIndex
+    from domain_index import DomainIndex
+    from dedup import Deduplicator, canonical_url, SUPPRESSED_PAGE_HASH
+    from fetcher import iter_fetch_documents, MAX_CONCURRENCY, PER_HOST_LIMIT
+    from page_store import PageStore, PAGE_MAX_AGE_HOURS
+    from transform import iter_transform_pages, TRANSFORM_WORKERS
+    from vector_store_mmap import build_from_chroma, mmap_dtype
+    import telemetry
 
 load_dotenv()
 PERSIST_DIRECTORY = "./data/chroma_db_full"
-REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT_SECONDS", 15)) 
-COLLECTION_NAME = "user-history-data" 
-
-def batch_load_documents(urls, batch_size=50):
-    raw_documents = []
-    
-    # keywords/domains to skip immediately to avoid login pages etc.
-    SKIP_DOMAINS = ['login', 'account', 'mfa', 'password', 'oauth']
-    # Filter out problematic URLs
-    filtered_urls = [url for url in urls if not any(skip_word in url for skip_word in SKIP_DOMAINS)]
-    
-    
-    print(f"Loading {len(filtered_urls)} URLs in batches of {batch_size}...")
-
-    for i in range(0, len(filtered_urls), batch_size):
-        batch_urls = filtered_urls[i:i + batch_size]
-        try:
-            # WebBaseLoader is synchronous, but we handle errors robustly
-            loader = WebBaseLoader(
-                web_paths=batch_urls,
-                requests_kwargs={
-                    "timeout": REQUEST_TIMEOUT
-                }
-            )
-            
-            batch_docs = loader.load()
-            raw_documents.extend(batch_docs)
-            print(f"Successfully loaded batch {i//batch_size + 1}. Total documents: {len(raw_documents)}")
-            
-        except Exception as e:
-            # Catch exceptions from the entire batch and skip it
-            print(f"⚠️ Error loading batch {i//batch_size + 1}: {e}")
-            continue 
-            
-    return raw_documents
-
-def process_and_index_webbase(history_data):
-    if not history_data:
-        print(f"No history data to process.")
-        return
-
-    valid_data = [
-        item for item in history_data
-        if item['url'] and (item['url'].startswith('http') or item['url'].startswith('https'))
-    ]
-    
-    urls = [item['url'] for item in valid_data]
-    url_to_meta = {item['url']: item for item in valid_data}
-    
-    print(f"Total valid URLs for fetching: {len(urls)}")
-    
-    raw_documents = batch_load_documents(urls, batch_size=50)
-    
-    print(f"Sucessfully loaded {len(raw_documents)} pages!")
-    
-    # TRANSFORM TO PLAIN TEXT
-    html2text = Html2TextTransformer() 
-    docs_transformed = html2text.transform_documents(raw_documents) 
-    
-    # METADATA ENRICHMENT
-    final_documents = []
-    for doc in docs_transformed:
-        url = doc.metadata.get('source')
-        if url in url_to_meta:
-            original_meta = url_to_meta[url]
-            doc.metadata['title'] = original_meta.get('title', 'No Title')
-            doc.metadata['date'] = original_meta.get('date')
-            final_documents.append(doc)
-    
-    # CHUNKING
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=200)
-    splits = text_splitter.split_documents(final_documents)
-    
-    if not splits:
-        print("No valid text found after transformation or chunking.")
-        return
-
-    print(f"Created {len(splits)} chunks.")
-    
-    # LOAD VECTOR STORE
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=OpenAIEmbeddings(),
+REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT_SECONDS", 15))
+COLLECTION_NAME = "user-history-data"
+UPSERT_BATCH_SIZE = 500
+COMMIT_EVERY = int(os.getenv("INGEST_COMMIT_EVERY", 1000))  # chunks embedded + upserted per commit
+
+# keywords/domains to skip immediately to avoid login pages etc.
+SKIP_DOMAINS = ['login', 'account', 'mfa', 'password', 'oauth']
+
+# --- STAGE 1: HISTORY RECORDS -> URLS WORTH FETCHING ---
+def filter_records(history_data, state, incremental, progress, domain_index=None, dedup=None):
+    for item in history_data:
+        progress['records'] += 1
+        if item.get('last_visit_time'):
+            progress['max_visit_time'] = max(progress['max_visit_time'], item['last_visit_time'])
+
+        url = item['url']
+        if not url or not (url.startswith('http') or url.startswith('https')):
+            continue
+        # Filter out problematic URLs
+        if any(skip_word in url for skip_word in SKIP_DOMAINS):
+            continue
+        if dedup is not None:
+            # the Chrome URL stays with the record: the domain table counts visits per Chrome URL
+            item.setdefault('source_url', url)
+            url = item['url'] = canonical_url(url)
+        # every visit counts towards the domain table, even pages that fail to fetch later
+        if domain_index is not None:
+            domain_index.add_visit(item)
+        # the same page under another fragment / tracking parameters / parameter order
+        if dedup is not None and not dedup.first_visit(url):
+            continue
+        # already committed by an earlier (possibly crashed) run
+        if incremental and state.is_committed(url, item.get('last_visit_time')):
+            progress['resumed'] += 1
+            progress['settled'].add(url)
+            continue
+        yield item
+
+# --- STAGE 2: FETCH ---
+def stream_load_documents(records, max_concurrency=MAX_CONCURRENCY, page_store=None, from_store=False,
+                          on_failure=None):
+    if from_store:
+        # OFFLINE - re-chunking / html2text experiments run from disk only
+        print(f"Loading pages from the page store ({page_store.count()} stored), no network...")
+        return page_store.iter_documents(records)
+
+    print(f"Loading URLs with up to {max_concurrency} concurrent requests ({PER_HOST_LIMIT} per host)...")
+
+    # pages download concurrently and a failing URL only drops itself;
+    # the fetcher stops pulling records while its output buffer is full
+    return iter_fetch_documents(
+        records,
+        max_concurrency=max_concurrency,
+        per_host_limit=PER_HOST_LIMIT,
+        timeout=REQUEST_TIMEOUT,
+        store=page_store,
+        on_failure=on_failure
+    )
+
+# --- STAGE 6: EMBED + UPSERT ---
+class BatchCommitter:
+    """Collects chunks and embeds/upserts them every `commit_every` chunks.
+
+    Page state is only recorded after its chunks are in the vector store, so a crash loses
+    at most the uncommitted batch.
+    """
+
+    def __init__(self, vectorstore, state, commit_every=COMMIT_EVERY, lexical_index=None):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.state = state
+        self.commit_every = commit_every
+        self.pages = []  # (url, page_hash, chunk ids, last_visit_time, stale ids)
+        self.documents = []
+        self.ids = []
+        self.total_chunks = 0
+        self.total_pages = 0
+
+    def add_page(self, url, page_hash, splits, last_visit_time, previous_ids=()):
+        page_ids = []
+        for split in splits:
+            split_id = chunk_id(url, split.page_content)
+            if split_id in page_ids:
+                continue  # identical chunk repeated within one page
+            page_ids.append(split_id)
+            self.ids.append(split_id)
+            self.documents.append(split)
+
+        # chunks that belonged to an older version of the page are removed
+        stale_ids = list(set(previous_ids) - set(page_ids))
+        self.pages.append((url, page_hash, page_ids, last_visit_time, stale_ids))
+
+        if len(self.documents) >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        if not self.pages:
+            return
+
+        # embedding happens inside add_documents, see the embed.documents span for its share
+        with telemetry.span("index.upsert"):
+            for i in range(0, len(self.documents), UPSERT_BATCH_SIZE):
+                self.vectorstore.add_documents(
+                    documents=self.documents[i:i + UPSERT_BATCH_SIZE],
+                    ids=self.ids[i:i + UPSERT_BATCH_SIZE]
+                )
+        # the full-text index holds the same chunks under the same IDs
+        if self.lexical_index is not None:
+            with telemetry.span("index.lexical"):
+                self.lexical_index.upsert(self.ids, self.documents)
+
+        stale_ids = [stale for page in self.pages for stale in page[4]]
+        if stale_ids:
+            with telemetry.span("index.delete_stale"):
+                self.vectorstore.delete(ids=stale_ids)
+                if self.lexical_index is not None:
+                    self.lexical_index.delete(stale_ids)
+
+        with telemetry.span("index.state"):
+            for url, page_hash, page_ids, last_visit_time, _ in self.pages:
+                self.state.record_page(url, page_hash, page_ids, last_visit_time)
+            self.state.commit()
+        telemetry.count("index.chunks", len(self.documents))
+        telemetry.count("index.stale_deleted", len(stale_ids))
+
+        self.total_chunks += len(self.documents)
+        self.total_pages += len(self.pages)
+        print(f"Committed {len(self.documents)} chunks from {len(self.pages)} pages "
+              f"(total: {self.total_chunks} chunks, {self.total_pages} pages, {len(stale_ids)} stale deleted).")
+
+        self.pages, self.documents, self.ids = [], [], []
+
+def process_and_index_webbase(history_data, incremental=False, commit_every=COMMIT_EVERY,
+                              workers=TRANSFORM_WORKERS, embedding_backend=EMBEDDING_BACKEND,
+                              from_store=False, page_max_age_hours=PAGE_MAX_AGE_HOURS):
+    """Stream history records through fetch -> html2text -> enrichment -> split -> embed -> upsert.
+
+    `history_data` can be a list or a lazy iterator (see extract_urls.iter_history_data).
+    Only one commit batch of chunks is held in memory at a time. html2text and splitting
+    run in a pool of `workers` processes while the fetcher keeps downloading.
+    Raw pages are kept in the page store; `from_store` re-ingests from it without any network.
+    """
+    state = IngestState(PERSIST_DIRECTORY)
+    # settled: URLs indexed (or found already indexed) in this run
+    progress = {'records': 0, 'resumed': 0, 'unchanged': 0, 'max_visit_time': 0, 'settled': set()}
+
+    # chunks embedded by any earlier run (any date range, any store) are served from the cache
+    backend = get_embedding_backend(embedding_backend)
+    embeddings = CachedEmbeddings(backend)
+    vectorstore = Chroma(
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings,
         persist_directory=PERSIST_DIRECTORY,
-        collection_name=COLLECTION_NAME 
+        collection_metadata=backend_metadata(backend)
     )
-    
+    check_collection(vectorstore, backend)
+    stamp_collection(vectorstore, backend_metadata(backend))
+    domain_index = DomainIndex(PERSIST_DIRECTORY)
+    committer = BatchCommitter(vectorstore, state, commit_every=commit_every,
+                               lexical_index=LexicalIndex(PERSIST_DIRECTORY))
+    dedup = Deduplicator()
+
+    # pages that failed in earlier runs are behind the watermark by now: retry them after the new visits
+    if incremental:
+        history_data = itertools.chain(history_data, state.failed_records())
+    records = filter_records(history_data, state, incremental, progress, domain_index, dedup)
+    page_store = PageStore(max_age_hours=page_max_age_hours)
+
+    # only transient fetch errors are retried; 404s, downloads and pages missing from the page
+    # store (--from-store) are not failures worth another attempt
+    retry = {}
+    def fetch_failed(record, retryable):
+        if retryable:
+            retry[record['url']] = record
+    fetched = stream_load_documents(records, page_store=page_store, from_store=from_store,
+                                    on_failure=fetch_failed)
+
+    # STAGES 3-5: HTML2TEXT -> METADATA ENRICHMENT -> SPLIT (process pool, see transform.py)
+    for record, page_hash, splits, page_fingerprint in iter_transform_pages(fetched, workers=workers):
+        url = record['url']
+        progress['settled'].add(url)
+
+        # CHANGE DETECTION - pages whose text did not change since the last run are not re-indexed
+        previous = state.get_pages([url]).get(url)
+        if incremental and previous and previous[0] == page_hash:
+            # still indexed, so later near-duplicates of it are still suppressed
+            dedup.add_page(page_fingerprint)
+            progress['unchanged'] += 1
+            state.record_page(url, page_hash, previous[1], record.get('last_visit_time'))
+            continue
+
+        # NEAR-DUPLICATES - a page that is almost the text of one already indexed is committed without
+        # chunks, so it is neither embedded nor retrieved twice; it keeps no content hash, so it is
+        # indexed on a later visit if the original is gone by then. Chunks repeated within the page
+        # are dropped.
+        if dedup.is_near_duplicate_page(page_fingerprint):
+            page_hash, splits = SUPPRESSED_PAGE_HASH, []
+        else:
+            splits = dedup.unique_chunks(splits)
+
+        committer.add_page(url, page_hash, splits, record.get('last_visit_time'),
+                           previous_ids=previous[1] if previous else ())
+
+    committer.commit()
+    domain_index.close()
+    page_store.close()
+    print(f"Embedding cache: {embeddings.stats()}")
+    print(f"Duplicates suppressed: {dedup.stats()}")
+    for name, value in dedup.stats().items():
+        telemetry.count(f"dedup.{name}", value)
+
+    if progress['records'] == 0:
+        print(f"No history data to process.")
+    elif incremental:
+        print(f"{progress['unchanged']} pages unchanged, {progress['resumed']} already committed.")
+
+    # RETRIES - the watermark moves past pages that failed to fetch, so they are kept for the next runs
+    given_up = state.update_failures(retry.values(), progress['settled'])
+    if retry:
+        print(f"⚠️ {len(retry)} pages failed and will be retried by the next incremental run"
+              f"{f' ({len(given_up)} given up after {MAX_FETCH_ATTEMPTS} attempts)' if given_up else ''}.")
+
+    # WATERMARK - only moves once the whole run went through, the next incremental run starts after it
+    if progress['max_visit_time']:
+        state.set_watermark(progress['max_visit_time'])
+    state.close()
+
+    # keep the agent's memmap index (VECTOR_STORE=mmap) in step with the collection
+    dtype = mmap_dtype(PERSIST_DIRECTORY)
+    if dtype:
+        build_from_chroma(vectorstore, PERSIST_DIRECTORY, dtype=dtype, metadata=vectorstore._collection.metadata)
+
     print(f"Data successfully saved to {PERSIST_DIRECTORY}!")
+    telemetry.print_summary()
 
 if __name__ == "__main__":
-    # records = get_history_data('2025-08-01', '2025-12-01')
-    records = get_history_data('2025-01-01', '2025-12-01')
-    if len(records) > 0:
-        print(f"full ingestion of {len(records)}")
-        process_and_index_webbase(records)
+    parser = argparse.ArgumentParser(description="Scrape and index Chrome history pages.")
+    parser.add_argument("--start", default="2025-01-01", help="start date (YYYY-MM-DD)")
+    parser.add_argument("--end", default="2025-12-01", help="end date (YYYY-MM-DD)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip visits already indexed (also resumes a crashed run) and unchanged pages")
+    parser.add_argument("--commit-every", type=int, default=COMMIT_EVERY,
+                        help="number of chunks embedded and upserted per commit")
+    parser.add_argument("--workers", type=int, default=TRANSFORM_WORKERS,
+                        help="processes used for html2text and chunking (1 = no pool)")
+    parser.add_argument("--embedding-backend", choices=["openai", "local"], default=EMBEDDING_BACKEND,
+                        help="local = all-MiniLM-L6-v2 on CPU via onnxruntime (must match the agent's)")
+    parser.add_argument("--from-store", action="store_true",
+                        help="read pages from the raw page store only, never the network (re-chunking runs)")
+    parser.add_argument("--page-max-age-hours", type=float, default=PAGE_MAX_AGE_HOURS,
+                        help="stored pages younger than this are not re-requested; older ones are revalidated")
+    args = parser.parse_args()
+
+    watermark = IngestState(PERSIST_DIRECTORY).get_watermark() if args.incremental else None
+    if watermark is not None:
+        records = iter_history_data_since(watermark)
     else:
-        print("No records found.")
\ No newline at end of file
+        # records = iter_history_data('2025-08-01', '2025-12-01')
+        records = iter_history_data(args.start, args.end)
+
+    mode = "incremental" if args.incremental else "full"
+    print(f"{mode} ingestion starting...")
+    process_and_index_webbase(records, incremental=args.incremental, commit_every=args.commit_every,
+                              workers=args.workers, embedding_backend=args.embedding_backend,
+                              from_store=args.from_store, page_max_age_hours=args.page_max_age_hours)
@@ -0,0 +1,224 @@
+# Timing spans, counters and value histograms for ingestion and the agent.
+# Always kept in-process (dumped to JSON with TELEMETRY_REPORT=path); also exported through the
+# OpenTelemetry SDK when OTEL_EXPORTER_OTLP_ENDPOINT is set.
+#
+#   python src/telemetry.py data/telemetry.json --top 15    # summarise the hot stages of a report
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+from contextlib import contextmanager
+
+TELEMETRY_REPORT = os.getenv("TELEMETRY_REPORT")  # write the JSON report here when the process exits
+MAX_SAMPLES = 4096  # per metric, for percentiles
+SERVICE_NAME = "web-history-agent"
+
+_lock = threading.Lock()
+_spans = {}  # name -> _Series of durations (seconds)
+_values = {}  # name -> _Series of observed values (tokens per turn, tool calls per turn...)
+_counters = {}  # name -> float
+
+_tracer = None
+_meter = None
+_otel_instruments = {}
+
+
+class _Series:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+        else:
+            self.samples[self.count % MAX_SAMPLES] = value
+
+    def merge(self, other: dict):
+        self.count += other["count"]
+        self.total += other["total"]
+        self.max = max(self.max, other["max"])
+        self.samples = (self.samples + other["samples"])[-MAX_SAMPLES:]
+
+    def raw(self) -> dict:
+        return {"count": self.count, "total": self.total, "max": self.max, "samples": list(self.samples)}
+
+    def summary(self, scale=1.0) -> dict:
+        ordered = sorted(self.samples)
+        pick = lambda pct: ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))] * scale if ordered else 0.0
+        return {"count": self.count, "total": round(self.total * scale, 3),
+                "mean": round(self.total / self.count * scale, 3) if self.count else 0.0,
+                "p50": round(pick(50), 3), "p95": round(pick(95), 3), "max": round(self.max * scale, 3)}
+
+
+# --- OPENTELEMETRY (optional) ---
+def _setup_otel():
+    """Wire the OTLP exporters when an endpoint is configured; the SDK is never required."""
+    global _tracer, _meter
+    if not os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"):
+        return
+    try:
+        from opentelemetry import metrics, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.sdk.metrics import MeterProvider
+        from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+    except ImportError as e:
+        print(f"⚠️ OTEL_EXPORTER_OTLP_ENDPOINT is set but OpenTelemetry is not installed ({e}).")
+        return
+
+    resource = Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", SERVICE_NAME)})
+    tracer_provider = TracerProvider(resource=resource)
+    tracer_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(tracer_provider)
+    metrics.set_meter_provider(MeterProvider(
+        resource=resource, metric_readers=[PeriodicExportingMetricReader(OTLPMetricExporter())]
+    ))
+    _tracer = trace.get_tracer(SERVICE_NAME)
+    _meter = metrics.get_meter(SERVICE_NAME)
+
+def _otel_instrument(kind: str, name: str):
+    key = (kind, name)
+    if key not in _otel_instruments:
+        if kind == "counter":
+            _otel_instruments[key] = _meter.create_counter(name)
+        elif kind == "duration":
+            _otel_instruments[key] = _meter.create_histogram(f"{name}.duration", unit="ms")
+        else:
+            _otel_instruments[key] = _meter.create_histogram(name)
+    return _otel_instruments[key]
+
+
+# --- RECORDING ---
+def _observe(table: dict, name: str, value: float):
+    with _lock:
+        series = table.get(name)
+        if series is None:
+            series = table[name] = _Series()
+        series.add(value)
+
+def record_duration(name: str, seconds: float):
+    """For work timed elsewhere (e.g. callback start/end pairs)."""
+    _observe(_spans, name, seconds)
+    if _meter is not None:
+        _otel_instrument("duration", name).record(seconds * 1000)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block of work under `name` (e.g. "fetch.request", "index.upsert")."""
+    started = time.perf_counter()
+    try:
+        if _tracer is not None:
+            with _tracer.start_as_current_span(name, attributes=attributes or None):
+                yield
+        else:
+            yield
+    finally:
+        record_duration(name, time.perf_counter() - started)
+
+def count(name: str, value: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    if _meter is not None:
+        _otel_instrument("counter", name).add(value)
+
+def observe(name: str, value: float):
+    """Record one value of a distribution, e.g. LLM calls in one turn."""
+    _observe(_values, name, value)
+    if _meter is not None:
+        _otel_instrument("value", name).record(value)
+
+
+# --- SNAPSHOTS (process pool workers hand theirs back to the parent) ---
+def drain() -> dict:
+    """Everything recorded so far, raw, and reset."""
+    global _spans, _values, _counters
+    with _lock:
+        snapshot = {"spans": {k: v.raw() for k, v in _spans.items()},
+                    "values": {k: v.raw() for k, v in _values.items()},
+                    "counters": dict(_counters)}
+        _spans, _values, _counters = {}, {}, {}
+    return snapshot
+
+def _reset_in_child():
+    """A forked child (transform pool worker) starts from a copy of the parent's tables and of a
+    lock another thread may have held at fork time. Start empty with a fresh lock, so what the
+    worker drains back is only its own work; its exporters' threads did not survive the fork either."""
+    global _lock, _spans, _values, _counters, _tracer, _meter
+    _lock = threading.Lock()
+    _spans, _values, _counters = {}, {}, {}
+    _tracer = _meter = None
+    _otel_instruments.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_in_child)
+
+def merge(snapshot: dict):
+    with _lock:
+        for key, table in (("spans", _spans), ("values", _values)):
+            for name, raw in snapshot[key].items():
+                table.setdefault(name, _Series()).merge(raw)
+        for name, value in snapshot["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+# --- REPORTING ---
+def report() -> dict:
+    with _lock:
+        return {
+            "spans_ms": {name: series.summary(scale=1000) for name, series in _spans.items()},
+            "values": {name: series.summary() for name, series in _values.items()},
+            "counters": dict(_counters),
+        }
+
+def dump_report(path: str = None):
+    path = path or TELEMETRY_REPORT
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report(), f, indent=2)
+    print(f"Telemetry report written to {path}")
+
+def print_summary(data: dict = None, top: int = 10):
+    """Hottest stages by total time, then counters and per-turn values."""
+    data = data or report()
+    spans = sorted(data["spans_ms"].items(), key=lambda item: item[1]["total"], reverse=True)
+    if spans:
+        print(f"{'stage':<32} {'calls':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for name, s in spans[:top]:
+            print(f"{name:<32} {s['count']:>8} {s['total'] / 1000:>9.2f} {s['mean']:>9.2f} "
+                  f"{s['p50']:>9.2f} {s['p95']:>9.2f}")
+    for name, s in sorted(data["values"].items()):
+        print(f"{name:<32} mean {s['mean']:.2f}  p95 {s['p95']:.2f}  max {s['max']:.2f}")
+    for name, value in sorted(data["counters"].items()):
+        print(f"{name:<32} {value:g}")
+
+
+_setup_otel()
+if TELEMETRY_REPORT and __name__ != "__main__":
+    atexit.register(dump_report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise a telemetry JSON report.")
+    parser.add_argument("report", nargs="?", default=TELEMETRY_REPORT)
+    parser.add_argument("--top", type=int, default=15, help="number of stages to show")
+    args = parser.parse_args()
+    if not args.report:
+        sys.exit("usage: python src/telemetry.py REPORT.json (or set TELEMETRY_REPORT)")
+
+    with open(args.report, encoding="utf-8") as f:
+        print_summary(json.load(f), top=args.top)
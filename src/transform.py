@@ -0,0 +1,109 @@
+# Parallel html2text + chunking stage for ingestion (process pool)
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from langchain_community.document_transformers import Html2TextTransformer
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+try:
+    from src import telemetry  # imported as src.* (bench/run.py)
+    from src.ingest_state import content_hash
+    from src.dedup import fingerprint_page
+except ImportError:
+    import telemetry  # run as a script from src/
+    from ingest_state import content_hash
+    from dedup import fingerprint_page
+
+CHUNK_SIZE = 1200
+CHUNK_OVERLAP = 200
+TRANSFORM_WORKERS = int(os.getenv("TRANSFORM_WORKERS", os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.getenv("TRANSFORM_PAGES_PER_TASK", 8))
+
+# built once per worker process
+_html2text = None
+_text_splitter = None
+
+
+def _init_worker(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    global _html2text, _text_splitter
+    _html2text = Html2TextTransformer()
+    _text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def transform_batch(batch):
+    """html2text -> metadata enrichment -> split for a list of (record, raw HTML Document).
+
+    Returns (record, page_hash, splits, fingerprint) per page, in the same order, where
+    fingerprint is the page SimHash dedup.Deduplicator compares.
+    """
+    if _html2text is None:
+        _init_worker()
+
+    results = []
+    for record, raw_doc in batch:
+        # TRANSFORM TO PLAIN TEXT
+        with telemetry.span("transform.html2text"):
+            doc = _html2text.transform_documents([raw_doc])[0]
+
+        # METADATA ENRICHMENT
+        doc.metadata['title'] = record.get('title', 'No Title')
+        doc.metadata['date'] = record.get('date')
+        if record.get('visit_ts') is not None:
+            doc.metadata['visit_ts'] = record['visit_ts']  # numeric, so the store can range-filter it
+
+        # CHUNKING
+        with telemetry.span("transform.split"):
+            splits = _text_splitter.split_documents([doc])
+        telemetry.count("transform.pages")
+        telemetry.count("transform.chunks", len(splits))
+        with telemetry.span("transform.fingerprint"):
+            fingerprint = fingerprint_page(doc.page_content)
+        results.append((record, content_hash(doc.page_content), splits, fingerprint))
+    return results
+
+
+def _transform_batch_in_worker(batch):
+    # a pool worker's spans and counters would stay in that process; send them back with the results
+    return transform_batch(batch), telemetry.drain()
+
+
+def _collect(future):
+    results, worker_telemetry = future.result()
+    telemetry.merge(worker_telemetry)
+    return results
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_transform_pages(fetched, workers=TRANSFORM_WORKERS, pages_per_task=PAGES_PER_TASK,
+                         chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Yield (record, page_hash, splits, fingerprint) for every fetched page, in input order.
+
+    Pages are handed to a process pool `pages_per_task` at a time. At most two tasks per
+    worker are queued, so the fetcher keeps downloading while the pool is busy and memory
+    stays bounded. workers=1 runs everything in this process.
+    """
+    if workers <= 1:
+        _init_worker(chunk_size, chunk_overlap)
+        for batch in _batched(fetched, pages_per_task):
+            yield from transform_batch(batch)
+        return
+
+    max_pending = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(chunk_size, chunk_overlap)) as pool:
+        pending = deque()
+        for batch in _batched(fetched, pages_per_task):
+            pending.append(pool.submit(_transform_batch_in_worker, batch))
+            # results come back in submission order, which keeps the output deterministic
+            while len(pending) >= max_pending:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
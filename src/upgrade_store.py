@@ -0,0 +1,83 @@
+# Bring a vector store indexed by an older version of scraping.py up to date:
+# numeric visit_ts metadata on every chunk, the FTS5 lexical index and the domain table
+
+import argparse
+from dotenv import load_dotenv
+from langchain_chroma import Chroma
+try:
+    from src.lexical_index import LexicalIndex, iso_to_epoch  # imported as src.*
+    from src.domain_index import DomainIndex
+    from src.embeddings import stamp_collection, LEGACY_METADATA
+except ImportError:
+    from lexical_index import LexicalIndex, iso_to_epoch  # run as a script from src/
+    from domain_index import DomainIndex
+    from embeddings import stamp_collection, LEGACY_METADATA
+
+load_dotenv()
+COLLECTION_NAME = "user-history-data"
+
+def backfill_visit_ts(vector_store, batch_size=1000):
+    """Derive visit_ts from the ISO `date` of chunks that don't have it yet."""
+    collection = vector_store._collection
+    offset, updated = 0, 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+
+        ids, metadatas = [], []
+        for chunk_id, meta in zip(batch["ids"], batch["metadatas"]):
+            meta = meta or {}
+            visit_ts = iso_to_epoch(meta.get('date'))
+            if 'visit_ts' not in meta and visit_ts is not None:
+                ids.append(chunk_id)
+                metadatas.append({**meta, 'visit_ts': visit_ts})
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            updated += len(ids)
+
+        offset += len(batch["ids"])
+
+    print(f"Added visit_ts to {updated} chunks.")
+
+def rebuild_domain_index(vector_store, domain_index, batch_size=1000):
+    """Fill the domain table from chunk metadata (visit counts are unknown here, so 1 per URL)."""
+    collection = vector_store._collection
+    offset = 0
+    seen = set()
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        for meta in batch["metadatas"]:
+            meta = meta or {}
+            url = meta.get('source')
+            if not url:
+                continue
+            if url not in seen:
+                seen.add(url)
+                domain_index.add_visit({
+                    'url': url,
+                    'title': meta.get('title'),
+                    'visit_ts': meta.get('visit_ts', iso_to_epoch(meta.get('date')))
+                })
+        offset += len(batch["ids"])
+
+    domain_index.flush()
+    print(f"Domain table has {domain_index.count()} URLs.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upgrade an existing Chroma store in place.")
+    parser.add_argument("--persist-directory", default="./data/chroma_db")
+    parser.add_argument("--collection", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    # only collection get/update calls here, nothing is embedded
+    store = Chroma(collection_name=args.collection, embedding_function=None,
+                   persist_directory=args.persist_directory)
+    # older stores carry no backend stamp; they were all embedded with OpenAI
+    if "embedding_backend" not in (store._collection.metadata or {}):
+        stamp_collection(store, LEGACY_METADATA)
+    backfill_visit_ts(store)
+    LexicalIndex(args.persist_directory).rebuild_from_chroma(store)
+    rebuild_domain_index(store, DomainIndex(args.persist_directory))
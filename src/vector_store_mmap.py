@@ -0,0 +1,305 @@
+# Memory-mapped exact vector index, an alternative to Chroma for the agent (VECTOR_STORE=mmap).
+# Vectors live in one contiguous int8 (or float16) .npy file next to columnar visit_ts / domain
+# arrays; a query is one vectorised scan over the rows that pass the filter.
+#
+#   python src/vector_store_mmap.py --persist-directory ./data/chroma_db --dtype int8
+
+import os
+import json
+import shutil
+import asyncio
+import argparse
+import threading
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+try:
+    from src import telemetry  # imported by agent.py
+    from src.domain_index import domain_of
+except ImportError:
+    import telemetry  # imported by the ingestion scripts in src/
+    from domain_index import domain_of
+
+MMAP_DIRNAME = "mmap_index"
+SCAN_BLOCK_ROWS = 16384  # rows dequantised at a time, bounds the float32 scratch memory
+NO_TIMESTAMP = -1
+
+
+def mmap_directory(persist_directory: str) -> str:
+    return os.path.join(persist_directory, MMAP_DIRNAME)
+
+
+def mmap_version(persist_directory: str):
+    """Changes whenever the index is rebuilt (for CachedRetriever's version_fn)."""
+    try:
+        return os.stat(os.path.join(mmap_directory(persist_directory), "meta.json")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def mmap_dtype(persist_directory: str) -> Optional[str]:
+    """dtype of the existing index, or None when the directory has none."""
+    try:
+        with open(os.path.join(mmap_directory(persist_directory), "meta.json"), encoding="utf-8") as f:
+            return json.load(f).get("dtype", "int8")
+    except OSError:
+        return None
+
+
+# --- BUILD ---
+def _quantize(vectors: np.ndarray, dtype: str):
+    """Unit-normalise rows (dot product = cosine), then int8 with a per-row scale or plain float16."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    if dtype == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+def build_from_chroma(vector_store, persist_directory: str, dtype: str = "int8",
+                      batch_size: int = 1000, metadata: Optional[dict] = None) -> int:
+    """Export every chunk vector of a Chroma collection into the memmap layout.
+
+    Written to a temporary directory and swapped in at the end, so readers never see a half index.
+    """
+    collection = vector_store._collection
+    total = collection.count()
+    target = mmap_directory(persist_directory)
+    building = target + ".building"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+
+    vectors = scales = None
+    visit_ts = np.full(total, NO_TIMESTAMP, dtype=np.int64)
+    domain_ids = np.zeros(total, dtype=np.int32)
+    ids, domains, domain_index = [], [], {}
+    offset = 0
+    while offset < total:
+        batch = collection.get(include=["embeddings", "metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        quantized, batch_scales = _quantize(batch["embeddings"], dtype)
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(os.path.join(building, "vectors.npy"), mode="w+",
+                                                dtype=quantized.dtype, shape=(total, quantized.shape[1]))
+            scales = np.lib.format.open_memmap(os.path.join(building, "scales.npy"), mode="w+",
+                                               dtype=np.float32, shape=(total,))
+        end = offset + len(batch["ids"])
+        vectors[offset:end] = quantized
+        scales[offset:end] = batch_scales
+        for row, meta in enumerate(batch["metadatas"], start=offset):
+            meta = meta or {}
+            if meta.get('visit_ts') is not None:
+                visit_ts[row] = meta['visit_ts']
+            domain = domain_of(meta.get('source', ''))
+            if domain not in domain_index:
+                domain_index[domain] = len(domains)
+                domains.append(domain)
+            domain_ids[row] = domain_index[domain]
+        ids.extend(batch["ids"])
+        offset = end
+
+    count = len(ids)
+    if vectors is not None:
+        vectors.flush()
+        scales.flush()
+        del vectors, scales
+    np.save(os.path.join(building, "visit_ts.npy"), visit_ts[:count])
+    np.save(os.path.join(building, "domain_ids.npy"), domain_ids[:count])
+    with open(os.path.join(building, "ids.json"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    with open(os.path.join(building, "domains.json"), "w", encoding="utf-8") as f:
+        json.dump(domains, f)
+    # meta.json last: its mtime is the index version
+    with open(os.path.join(building, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"count": count, "dtype": dtype, **(metadata or {})}, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(building, target)
+    print(f"Memmap index: {count} vectors ({dtype}) written to {target}")
+    return count
+
+
+# --- QUERY ---
+class MmapVectorStore:
+    """Read-only exact top-k store with the retriever-facing part of the vector store interface.
+
+    Vectors are memory-mapped, so opening the store costs a few file headers and the OS only pages
+    in what scans touch. Chunk text is not duplicated here: `document_lookup(ids)` (the lexical
+    index's get_documents) turns the winning IDs into Documents.
+    """
+
+    def __init__(self, persist_directory: str, document_lookup: Callable[[List[str]], List[Any]]):
+        directory = mmap_directory(persist_directory)
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta["count"]:
+            self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            self.scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+        else:
+            self.vectors, self.scales = np.zeros((0, 1), dtype=np.int8), np.zeros(0, dtype=np.float32)
+        self.visit_ts = np.load(os.path.join(directory, "visit_ts.npy"))
+        self.domain_ids = np.load(os.path.join(directory, "domain_ids.npy"))
+        with open(os.path.join(directory, "ids.json"), encoding="utf-8") as f:
+            self.ids = json.load(f)
+        with open(os.path.join(directory, "domains.json"), encoding="utf-8") as f:
+            self.domain_lookup = {domain: i for i, domain in enumerate(json.load(f))}
+        self.document_lookup = document_lookup
+
+    def __len__(self):
+        return len(self.ids)
+
+    # --- FILTERS ---
+    def _mask(self, filter: Optional[dict]):
+        """Boolean row mask for Chroma-style `where` filters on visit_ts / domain, or None for all rows."""
+        if not filter:
+            return None
+        if "$and" in filter:
+            mask = np.ones(len(self.ids), dtype=bool)
+            for clause in filter["$and"]:
+                clause_mask = self._mask(clause)
+                if clause_mask is not None:
+                    mask &= clause_mask
+            return mask
+
+        mask = np.ones(len(self.ids), dtype=bool)
+        for field, condition in filter.items():
+            if field == "visit_ts":
+                column = self.visit_ts
+                mask &= column != NO_TIMESTAMP
+            elif field == "domain":
+                column = self.domain_ids
+                if isinstance(condition, dict) and "$in" in condition:
+                    condition = {"$in": [self.domain_lookup.get(d, -1) for d in condition["$in"]]}
+                elif isinstance(condition, dict) and "$eq" in condition:
+                    condition = {"$eq": self.domain_lookup.get(condition["$eq"], -1)}
+                else:
+                    condition = {"$eq": self.domain_lookup.get(condition, -1)}
+            else:
+                raise ValueError(f"MmapVectorStore can only filter on visit_ts and domain, not '{field}'.")
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator == "$gte":
+                    mask &= column >= value
+                elif operator == "$gt":
+                    mask &= column > value
+                elif operator == "$lt":
+                    mask &= column < value
+                elif operator == "$lte":
+                    mask &= column <= value
+                elif operator == "$eq":
+                    mask &= column == value
+                elif operator == "$in":
+                    mask &= np.isin(column, value)
+                else:
+                    raise ValueError(f"Unsupported filter operator '{operator}'.")
+        return mask
+
+    # --- SEARCH ---
+    def top_k(self, embedding: List[float], k: int, filter: Optional[dict] = None):
+        """(row, cosine score) pairs, best first, over the rows that pass `filter`."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        mask = self._mask(filter)
+        rows = np.flatnonzero(mask) if mask is not None else None
+        total = len(rows) if rows is not None else len(self.ids)
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(start + SCAN_BLOCK_ROWS, total))
+                block = self.vectors[start:start + SCAN_BLOCK_ROWS]
+            else:
+                block_rows = rows[start:start + SCAN_BLOCK_ROWS]
+                block = self.vectors[block_rows]
+            scores = (block.astype(np.float32) @ query) * self.scales[block_rows]
+            if len(scores) > k:
+                keep = np.argpartition(-scores, k)[:k]
+                block_rows, scores = block_rows[keep], scores[keep]
+            best_rows = np.concatenate([best_rows, block_rows])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k)[:k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+        order = np.argsort(-best_scores)
+        return [(int(best_rows[i]), float(best_scores[i])) for i in order]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        with telemetry.span("retrieval.mmap_scan"):
+            hits = self.top_k(embedding, k, filter)
+        return self.document_lookup([self.ids[row] for row, _ in hits])
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                           filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        # numpy releases the GIL for the matrix product; keep the event loop free meanwhile
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k, filter)
+
+
+class ReopeningMmapVectorStore:
+    """MmapVectorStore for long-running processes: reopens the index when it is rebuilt.
+
+    A rebuild replaces the whole directory, so an open store would keep scanning the old files.
+    Each search compares mmap_version first (one stat) and swaps in a freshly opened store when it
+    changed; searches already running finish on the store they started with. `on_open(store)` runs
+    for every store opened (e.g. check_metadata).
+    """
+
+    def __init__(self, persist_directory: str, document_lookup: Callable[[List[str]], List[Any]],
+                 on_open: Optional[Callable[[MmapVectorStore], None]] = None):
+        self.persist_directory = persist_directory
+        self.document_lookup = document_lookup
+        self.on_open = on_open
+        self.lock = threading.Lock()
+        self.store, self.version = None, None
+        self.current()
+
+    def current(self) -> MmapVectorStore:
+        version = mmap_version(self.persist_directory)
+        with self.lock:
+            # no version while a rebuild swaps the directory: keep the old store until it is back
+            if self.store is None or (version is not None and version != self.version):
+                store = MmapVectorStore(self.persist_directory, self.document_lookup)
+                if self.on_open is not None:
+                    self.on_open(store)
+                if self.store is not None:
+                    print(f"Memmap index in {self.persist_directory} was rebuilt, reopened ({len(store)} vectors).")
+                self.store, self.version = store, version
+            return self.store
+
+    @property
+    def meta(self) -> dict:
+        return self.current().meta
+
+    def __len__(self):
+        return len(self.current())
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        return self.current().similarity_search_by_vector(embedding, k, filter)
+
+    async def asimilarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                           filter: Optional[dict] = None, **kwargs) -> List[Any]:
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k, filter)
+
+
+if __name__ == "__main__":
+    from langchain_chroma import Chroma
+
+    parser = argparse.ArgumentParser(description="Build the memmap vector index from a Chroma store.")
+    parser.add_argument("--persist-directory", default="./data/chroma_db")
+    parser.add_argument("--collection", default="user-history-data")
+    parser.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    args = parser.parse_args()
+
+    # vectors are copied as stored, nothing is embedded here
+    store = Chroma(collection_name=args.collection, embedding_function=None,
+                   persist_directory=args.persist_directory)
+    build_from_chroma(store, args.persist_directory, dtype=args.dtype, metadata=store._collection.metadata)
@@ -0,0 +1,7 @@
+# Tests import the repo the way agent.py and the benchmarks do: from the root, modules as src.*
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
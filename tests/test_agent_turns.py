@@ -0,0 +1,62 @@
+# Agent turns against a scripted model: no OpenAI, no vector store
+import uuid
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain.agents")
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+import agent
+from bench.fakes import FakeHistoryChatModel
+from src.conversation_memory import SqliteCheckpointer
+
+
+class LoopingOnSecondTurn(FakeHistoryChatModel):
+    """Answers the first question normally; from the second on it only ever asks for search_history."""
+
+    def _next_message(self, messages):
+        if sum(isinstance(m, HumanMessage) for m in messages) < 2:
+            return super()._next_message(messages)
+        self.calls += 1
+        call = {"name": "search_history", "args": {"query": "again"}, "id": f"call_{uuid.uuid4().hex[:12]}"}
+        return AIMessage(content="", tool_calls=[call])
+
+
+class EmptyRetriever:
+    def invoke(self, query, **kwargs):
+        return []
+
+    async def ainvoke(self, query, **kwargs):
+        return []
+
+
+@pytest.fixture
+def scripted_agent(tmp_path, monkeypatch):
+    model = LoopingOnSecondTurn()
+    monkeypatch.setattr(agent, "MAX_LLM_CALLS_PER_TURN", 3)
+    monkeypatch.setattr(agent, "get_llm", lambda: model)
+    monkeypatch.setattr(agent, "get_retriever", lambda: EmptyRetriever())
+    monkeypatch.setattr(agent, "get_user_profile", lambda: "No user profile available.")
+    checkpointer = SqliteCheckpointer(str(tmp_path / "conversations.sqlite3"))
+    monkeypatch.setattr(agent, "get_checkpointer", lambda: checkpointer)
+    agent.get_agent.cache_clear()
+    yield model
+    agent.get_agent.cache_clear()
+
+
+def test_limit_hit_on_second_turn_does_not_return_first_answer(scripted_agent):
+    first = agent.history_qa_agent_invoke("What did I read?", "thread-1")
+    assert first.answer.startswith("Found ")
+
+    second = agent.history_qa_agent_invoke("And after that?", "thread-1")
+    assert second.answer != first.answer
+    assert "allowed number of steps" in second.answer
+
+
+def test_limit_hit_on_second_async_turn_does_not_return_first_answer(scripted_agent):
+    first = asyncio.run(agent.history_qa_agent_ainvoke("What did I read?", "thread-2"))
+    second = asyncio.run(agent.history_qa_agent_ainvoke("And after that?", "thread-2"))
+    assert second.answer != first.answer
+    assert "allowed number of steps" in second.answer
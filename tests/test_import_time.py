@@ -0,0 +1,43 @@
+# Cold import-time budget for agent.py: nothing heavy may be built or imported at import (see the
+# lazy factories in agent.py). Each measurement is a fresh `python -X importtime` interpreter.
+import os
+import re
+import sys
+import subprocess
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("langchain_core")
+
+ROOT = Path(__file__).resolve().parent.parent
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500))
+RUNS = 3  # the fastest run counts, the others absorb a cold disk cache
+# built on first use only; importing any of them at import time is a regression whatever the timing
+LAZY_MODULES = ("chromadb", "langchain_chroma", "langchain_openai", "openai", "onnxruntime", "langchain.agents")
+
+# "import time:       self [us] |  cumulative | imported package"
+_LINE_RE = re.compile(r"import time:\s+(\d+)\s*\|\s*(\d+)\s*\|\s*(\S+)")
+
+
+def measure(module: str):
+    """(cumulative ms of `module`, {imported module: cumulative ms}) of one cold import."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr.strip().splitlines()[-1:]
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            modules[match.group(3)] = int(match.group(2)) / 1000
+    return modules[module], modules
+
+
+def test_agent_import_stays_lazy_and_within_budget():
+    total, modules = min((measure("agent") for _ in range(RUNS)), key=lambda run: run[0])
+    eager = [name for name in LAZY_MODULES if name in modules]
+    assert not eager, f"imported at import time, should be lazy: {eager}"
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:5]
+    assert total <= IMPORT_TIME_BUDGET_MS, \
+        f"import agent took {total:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms); slowest: {slowest}"